@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+from aiohttp import web
+
+# Сценарий пользователя после анкеты: команда и ее вес в смеси
+MIX = {"log_water": 30, "log_food": 20, "log_workout": 10, "check_progress": 15, "plot_water": 5,
+       "plot_calories": 5, "stats": 5, "new_day": 2}
+CITIES = ["Москва", "Казань", "Сочи", "Омск", "Пермь", "Уфа"]
+FOODS = ["банан", "яблоко", "гречка", "творог", "курица", "омлет"]
+MEALS = ["2 яйца и 100г рис", "куриная грудка 200г, гречка 150г", "творог 200 + банан", "пицца, кола"]
+# блюд нет в локальной базе: перевод и Nutritionix идут в заглушки
+DISHES = [f"запеканка {index}" for index in range(20)]
+WORKOUTS = ["бег", "плавание", "йога", "бокс", "паркур"]
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Процентиль по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def rss_mb() -> float:
+    """Текущий резидентный размер процесса в МБ"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # без /proc остается только пиковое значение
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """Пиковый резидентный размер процесса в МБ"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class FakeUpstreams:
+    """Заглушки openweathermap, Nutritionix и переводчика MyMemory с настраиваемой задержкой и ошибками"""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def _delay(self, name: str) -> web.Response | None:
+        self.calls[name] += 1
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        if self.random.random() < self.error_rate:
+            return web.Response(status=503)
+        return None
+
+    async def weather(self, _request: web.Request) -> web.Response:
+        return await self._delay("weather") or web.json_response({"main": {"temp": self.random.uniform(-5, 35)}})
+
+    async def nutrients(self, request: web.Request) -> web.Response:
+        error = await self._delay("nutrients")
+        if error:
+            return error
+        query = (await request.json())["query"]
+        foods = [{"food_name": item, "nf_calories": 180.0, "serving_weight_grams": 150.0, "serving_qty": 1,
+                  "serving_unit": "serving"} for item in query.split(" and ")]
+        return web.json_response({"foods": foods})
+
+    async def exercise(self, request: web.Request) -> web.Response:
+        error = await self._delay("exercise")
+        if error:
+            return error
+        query = (await request.json())["query"]
+        return web.json_response({"exercises": [{"name": query.rsplit(" ", 1)[0], "met": 8.0, "nf_calories": 300.0}]})
+
+    async def translate(self, request: web.Request) -> web.Response:
+        error = await self._delay("translate")
+        if error:
+            return error
+        text = request.query["q"]
+        return web.json_response({"responseData": {"translatedText": f"dish {text.split()[-1]}"}, "matches": []})
+
+    async def start(self):
+        """Запуск заглушек на свободном порту"""
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", self.weather)
+        app.router.add_post("/v2/natural/nutrients", self.nutrients)
+        app.router.add_post("/v2/natural/exercise", self.exercise)
+        app.router.add_get("/get", self.translate)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint: disable=W0212
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        """Остановка заглушек"""
+        await self.runner.cleanup()
+
+
+def make_session(latency: float):
+    """Сессия Bot API без сети: методы возвращают правдоподобные ответы через latency секунд"""
+    # pylint: disable=C0415
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message
+
+    class FakeSession(BaseSession):
+        """Заглушка сессии бота"""
+
+        def __init__(self):
+            super().__init__()
+            self.requests: Counter = Counter()
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def make_request(self, bot, method, timeout=None):
+            self.requests[type(method).__name__] += 1
+            if latency:
+                await asyncio.sleep(latency)
+            if method.__returning__ is Message:
+                chat_id = getattr(method, "chat_id", 0)
+                return Message(message_id=1, date=int(time.time()), chat=Chat(id=chat_id, type="private"))
+            return True
+
+    return FakeSession()
+
+
+class Simulation:
+    """Синтетические пользователи: анкета /set_profile, затем случайная смесь команд"""
+
+    def __init__(self, users: int, actions: int, seed: int, mix: dict[str, int]):
+        self.users = users
+        self.actions = actions
+        self.seed = seed
+        self.mix = mix
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def message(self, user_id: int, text: str) -> dict:
+        """Необработанное обновление с сообщением"""
+        update_id = self._next_id()
+        message = {"message_id": update_id, "date": int(time.time()), "text": text,
+                   "chat": {"id": user_id, "type": "private"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        """Необработанное обновление с нажатием кнопки"""
+        update_id = self._next_id()
+        message = {"message_id": update_id, "date": int(time.time()), "text": "?",
+                   "chat": {"id": user_id, "type": "private"}, "from": {"id": 1, "is_bot": True, "first_name": "bot"}}
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "chat_instance": str(user_id), "data": data, "message": message,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}}
+
+    def script(self, user_id: int) -> list[tuple[str, dict]]:
+        """Обновления пользователя по порядку с меткой для статистики"""
+        rnd = random.Random(self.seed * 1_000_003 + user_id)
+        steps = [("set_profile", self.message(user_id, "/set_profile")),
+                 ("wizard", self.message(user_id, str(rnd.randint(55, 110)))),
+                 ("wizard", self.message(user_id, str(rnd.randint(150, 200)))),
+                 ("wizard", self.message(user_id, str(rnd.randint(18, 70)))),
+                 ("wizard", self.message(user_id, rnd.choice(CITIES))),
+                 ("callback", self.callback(user_id, rnd.choice(["sex:1", "sex:0"]))),
+                 ("callback", self.callback(user_id, f"act:{rnd.randint(1, 5)}")),
+                 ("wizard", self.message(user_id, str(rnd.randint(1500, 3000))))]
+        commands = rnd.choices(list(self.mix), weights=list(self.mix.values()), k=self.actions)
+        for command in commands:
+            if command == "log_water":
+                steps.append((command, self.message(user_id, f"/log_water {rnd.randint(100, 500)}")))
+            elif command == "log_food":
+                kind = rnd.random()
+                if kind < 0.5:
+                    steps.append((command, self.message(user_id, f"/log_food {rnd.choice(FOODS)}")))
+                    steps.append(("grams", self.message(user_id, str(rnd.randint(50, 300)))))
+                elif kind < 0.8:
+                    steps.append(("log_food_meal", self.message(user_id, f"/log_food {rnd.choice(MEALS)}")))
+                else:
+                    steps.append(("log_food_remote", self.message(user_id, f"/log_food 1 {rnd.choice(DISHES)}")))
+            elif command == "log_workout":
+                steps.append((command, self.message(user_id, f"/log_workout {rnd.choice(WORKOUTS)} "
+                                                             f"{rnd.randint(10, 90)}")))
+            else:
+                steps.append((command, self.message(user_id, f"/{command}")))
+        return steps
+
+
+async def monitor_lag(samples: list[float], interval: float = 0.01):
+    """Задержка event loop: насколько позже запланированного просыпается sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+def configure_env(upstreams_url: str):
+    """Окружение бота до импорта config: заглушки вместо внешних API и без лишних фоновых задач"""
+    defaults = {
+        "BOT_TOKEN": "42:BENCH", "WEATHER_TOKEN": "bench", "NUTRITIONIX_ID": "bench", "NUTRITIONIX_TOKEN": "bench",
+        "STORAGE_BACKEND": "memory", "FSM_STORAGE": "memory", "METRICS_PORT": "0", "WEATHER_PREFETCH_AT": "",
+        "LOG_LEVEL": "WARNING", "LOG_SAMPLE_RATE": "0", "CACHE_DB_PATH": "", "NUTRITION_DB_PATH": "",
+        # без лимитов на пользователя: синтетические пользователи шлют сообщения без пауз
+        "THROTTLE_RATE": "0", "NUTRITIONIX_RATE": "0", "WEATHER_RATE": "0",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    # адреса внешних API всегда ведут в заглушки
+    os.environ["NUTRITIONIX_API_URL"] = upstreams_url
+    os.environ["WEATHER_API_URL"] = upstreams_url
+    os.environ["TRANSLATE_API_URL"] = f"{upstreams_url}/get"
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """Прогон нагрузки и сбор результатов"""
+    upstreams = FakeUpstreams(args.latency / 1000, args.jitter / 1000, args.error_rate, args.seed)
+    await upstreams.start()
+    configure_env(upstreams.url)
+    # pylint: disable=C0415
+    from aiogram import Bot
+    from bot import dp
+
+    session = make_session(args.telegram_latency / 1000)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    gc.collect()
+    rss_start = rss_mb()
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+
+    mix = {command: weight for command, weight in MIX.items()
+           if not (args.no_charts and command.startswith("plot_"))}
+    simulation = Simulation(args.users, args.actions, args.seed, mix)
+    scripts = [simulation.script(user_id) for user_id in range(1, args.users + 1)]
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    lag: list[float] = []
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def play(steps: list[tuple[str, dict]]):
+        async with limit:
+            for label, update in steps:
+                start = time.perf_counter()
+                try:
+                    await dp.feed_raw_update(bot, update)
+                except Exception:  # pylint: disable=W0718
+                    errors[label] += 1
+                latencies[label].append(time.perf_counter() - start)
+
+    monitor = asyncio.create_task(monitor_lag(lag))
+    started = time.perf_counter()
+    await asyncio.gather(*(play(steps) for steps in scripts))
+    duration = time.perf_counter() - started
+    monitor.cancel()
+    gc.collect()
+    rss_end = rss_mb()
+
+    await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+    await upstreams.stop()
+
+    updates = sum(len(values) for values in latencies.values())
+    return {
+        "meta": {"users": args.users, "actions": args.actions, "concurrency": args.concurrency,
+                 "latency_ms": args.latency, "jitter_ms": args.jitter, "error_rate": args.error_rate,
+                 "telegram_latency_ms": args.telegram_latency, "seed": args.seed, "charts": not args.no_charts,
+                 "python": platform.python_version(), "started": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "updates": updates,
+        "duration_s": round(duration, 3),
+        "throughput_ups": round(updates / duration, 1),
+        "commands": {label: {"count": len(values), "errors": errors[label],
+                             "p50_ms": round(percentile(values, 50) * 1000, 2),
+                             "p95_ms": round(percentile(values, 95) * 1000, 2),
+                             "p99_ms": round(percentile(values, 99) * 1000, 2),
+                             "max_ms": round(max(values) * 1000, 2)}
+                     for label, values in sorted(latencies.items())},
+        "loop_lag_ms": {"p50": round(percentile(lag, 50) * 1000, 2), "p99": round(percentile(lag, 99) * 1000, 2),
+                        "max": round(max(lag, default=0) * 1000, 2)},
+        "memory_mb": {"rss_start": round(rss_start, 1), "rss_end": round(rss_end, 1),
+                      "growth": round(rss_end - rss_start, 1), "peak": round(peak_rss_mb(), 1)},
+        "upstream_calls": dict(upstreams.calls),
+        "telegram_calls": dict(session.requests),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Регрессии относительно прошлого прогона: p95 команд, пропускная способность и задержка loop"""
+    regressions = []
+    for label, stats in result["commands"].items():
+        before = baseline["commands"].get(label)
+        if before and before["p95_ms"] and stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {before['p95_ms']} -> {stats['p95_ms']} мс")
+    if result["throughput_ups"] < baseline["throughput_ups"] * (1 - tolerance):
+        regressions.append(f"пропускная способность {baseline['throughput_ups']} -> {result['throughput_ups']} upd/s")
+    if result["loop_lag_ms"]["p99"] > max(baseline["loop_lag_ms"]["p99"], 1) * (1 + tolerance):
+        regressions.append(f"задержка loop p99 {baseline['loop_lag_ms']['p99']} -> {result['loop_lag_ms']['p99']} мс")
+    return regressions
+
+
+def print_report(result: dict):
+    """Таблица результатов в консоль"""
+    print(f"{result['updates']} обновлений за {result['duration_s']} с, {result['throughput_ups']} upd/s")
+    print(f"{'команда':<18}{'кол-во':>8}{'ошибки':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for label, stats in result["commands"].items():
+        print(f"{label:<18}{stats['count']:>8}{stats['errors']:>8}{stats['p50_ms']:>9}{stats['p95_ms']:>9}"
+              f"{stats['p99_ms']:>9}{stats['max_ms']:>9}")
+    lag, memory = result["loop_lag_ms"], result["memory_mb"]
+    print(f"задержка loop, мс: p50 {lag['p50']}, p99 {lag['p99']}, max {lag['max']}")
+    print(f"память, МБ: {memory['rss_start']} -> {memory['rss_end']} (+{memory['growth']}), пик {memory['peak']}")
+    print(f"внешние API: {result['upstream_calls']}, Bot API: {result['telegram_calls']}")
+
+
+def main():
+    """Нагрузочный тест из командной строки"""
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков с заглушками Telegram и внешних API")
+    parser.add_argument("--users", type=int, default=1000, help="число пользователей")
+    parser.add_argument("--actions", type=int, default=10, help="команд на пользователя после анкеты")
+    parser.add_argument("--concurrency", type=int, default=200, help="пользователей одновременно")
+    parser.add_argument("--latency", type=float, default=50, help="задержка внешних API, мс")
+    parser.add_argument("--jitter", type=float, default=20, help="разброс задержки внешних API, мс")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 503 от внешних API")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="задержка Bot API, мс")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-charts", action="store_true", help="без /plot_water и /plot_calories")
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,118 @@
 import asyncio
+import contextlib
+import logging
 from aiogram import Bot, Dispatcher
-from config import TOKEN
-from handlers import setup_handlers
-from middlewares import LoggingMiddleware
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from charts import shutdown_executor as shutdown_charts
+from config import settings
+from diagnostics import Diagnostics, process_uptime, startup_report
+from fsm_storage import create_fsm_storage
+from handlers import nutritionix, setup_handlers
+from http_client import create_http_session
+from logs import setup_logging
+from metrics import serve_metrics
+from nutrition import NutritionDB
+from middlewares import ActivityMiddleware, LoggingMiddleware, MetricsMiddleware, ThrottlingMiddleware
+from scheduler import RolloverScheduler
+from storage import create_user_store
+from translation import executor as translate_executor
+from weather import run_prefetch_scheduler, weather_api
+from webhook import run_webhook
+
+logger = logging.getLogger(__name__)
+# Время импорта модулей для отчета о запуске
+IMPORTED = process_uptime()
 
 # Создаем экземпляры бота и диспетчера
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# TELEGRAM_API_URL позволяет указать локальный Bot API сервер или заглушку для тестов
+bot = Bot(token=settings.bot_token, session=AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+          if settings.telegram_api_url else None)
+dp = Dispatcher(storage=create_fsm_storage())
 
 # Настраиваем middleware и обработчики
+# ограничение стоит до метрик, чтобы отброшенные обновления не попадали во время обработчиков;
+# один экземпляр на сообщения и нажатия кнопок, чтобы лимит пользователя был общим
+throttling = ThrottlingMiddleware()
+activity = ActivityMiddleware()
 dp.message.middleware(LoggingMiddleware())
+dp.message.middleware(throttling)
+dp.message.middleware(activity)
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(throttling)
+dp.callback_query.middleware(activity)
+dp.callback_query.middleware(MetricsMiddleware())
 setup_handlers(dp)
 
 
+@dp.startup()
+async def on_startup(dispatcher: Dispatcher, metrics_port: int = settings.metrics_port,
+                     shard: tuple[int, int] | None = None):
+    """Создание общей HTTP-сессии, хранилища, локальной базы питания и планировщика.
+
+    В обработчики они передаются как http, store, nutrition и scheduler.
+
+    shard - номер воркера и число воркеров при запуске через cluster.py.
+    """
+    dispatcher["log_listener"] = setup_logging()
+    if shard:
+        # квоты провайдеров общие на все воркеры
+        for api in (nutritionix, weather_api):
+            api.share_quota(shard[1])
+    for feature in settings.disabled_features():
+        logger.warning("Отключено: %s", feature)
+    diagnostics = None
+    if settings.diag_enabled:
+        diagnostics = Diagnostics(settings.diag_lag_interval, settings.diag_block_threshold, settings.diag_profile_hz,
+                                  settings.diag_profile_max_seconds)
+        diagnostics.start()
+        dispatcher["diagnostics"] = diagnostics
+    if metrics_port:
+        dispatcher["metrics_server"] = await serve_metrics(settings.metrics_host, metrics_port,
+                                                           diagnostics.add_routes if diagnostics else None)
+    dispatcher["http"] = create_http_session()
+    store = create_user_store()
+    await store.start()
+    dispatcher["store"] = store
+    dispatcher["nutrition"] = NutritionDB.load(settings.nutrition_db_path, settings.nutrition_dataset)
+    background = dispatcher["background_tasks"] = []
+    if settings.weather_prefetch_at is not None and settings.weather_enabled:
+        background.append(asyncio.create_task(run_prefetch_scheduler(dispatcher["http"], store)))
+    if settings.rollover_enabled:
+        owns = (lambda user_id: user_id % shard[1] == shard[0]) if shard else (lambda user_id: True)
+        scheduler = RolloverScheduler(store, dispatcher["http"], owns)
+        dispatcher["scheduler"] = scheduler
+        background.append(asyncio.create_task(scheduler.run()))
+    startup_report(IMPORTED)
+
+
+@dp.shutdown()
+async def on_shutdown(dispatcher: Dispatcher):
+    """Закрытие общей HTTP-сессии, хранилищ, пулов переводчика и отрисовки"""
+    for task in dispatcher["background_tasks"]:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await dispatcher["http"].close()
+    await dispatcher["store"].close()
+    dispatcher["nutrition"].close()
+    await dispatcher.storage.close()
+    translate_executor.shutdown(wait=False, cancel_futures=True)
+    shutdown_charts()
+    if "metrics_server" in dispatcher.workflow_data:
+        await dispatcher["metrics_server"].cleanup()
+    if "diagnostics" in dispatcher.workflow_data:
+        await dispatcher["diagnostics"].stop()
+    dispatcher["log_listener"].stop()
+
+
 async def main():
     """Функция запуска бота"""
     print("Бот запущен!")
-    await dp.start_polling(bot)
+    if settings.run_mode == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
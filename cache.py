@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _LoadAbandoned(Exception):
+    """Загрузку отменили у запроса, который ее начал, ожидающие запросы загружают значение сами"""
+
+
+# Все кэши процесса, для экспорта статистики в метрики
+all_caches: list = []
+
+
+def normalize_query(text: str) -> str:
+    """Приведение запроса к единому виду для ключа кэша"""
+    return " ".join(text.lower().split())
+
+
+class DiskTier:
+    """Дисковый уровень кэша в SQLite, переживает перезапуск бота"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                           "name TEXT, key TEXT, value TEXT, expires REAL, PRIMARY KEY (name, key))")
+        self._conn.commit()
+
+    def get(self, name: str, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM cache WHERE name = ? AND key = ?",
+                                     (name, key)).fetchone()
+        if row is None or row[1] < time.time():
+            return _MISSING, 0.0
+        return json.loads(row[0]), row[1]
+
+    def set(self, name: str, key: str, value: Any, expires: float):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                               (name, key, json.dumps(value), expires))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TTLCache:
+    """LRU-кэш ограниченного размера с временем жизни записей и объединением одинаковых запросов.
+
+    При stale_ttl > 0 устаревшая запись еще stale_ttl секунд отдается сразу,
+    а свежее значение загружается в фоне.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, disk: Optional[DiskTier] = None,
+                 stale_ttl: float = 0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.stale = 0
+        self._data: OrderedDict = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._refreshes: set[asyncio.Task] = set()
+        all_caches.append(self)
+
+    def get(self, key: str, allow_stale: bool = False):
+        """Значение из памяти или _MISSING, если его нет или оно устарело"""
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        value, expires = item
+        now = time.monotonic()
+        if expires < now:
+            if allow_stale and expires + self.stale_ttl >= now:
+                return value
+            if expires + self.stale_ttl < now:
+                del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Запись значения в память с вытеснением самых старых записей"""
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]):
+        """Получение значения из кэша, при промахе одновременные запросы ключа ждут одну загрузку"""
+        value = self.get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        if self.stale_ttl:
+            value = self.get(key, allow_stale=True)
+            if value is not _MISSING:
+                self.stale += 1
+                if key not in self._pending:
+                    self.refresh_in_background(key, loader)
+                return value
+        return await self._load_coalesced(key, loader)
+
+    def refresh_in_background(self, key: str, loader: Callable[[], Awaitable[Any]]):
+        """Фоновое обновление значения без ожидания результата"""
+        task = asyncio.create_task(self.refresh(key, loader))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Не удалось обновить запись кэша %s: %r", self.name, task.exception())
+
+    async def refresh(self, key: str, loader: Callable[[], Awaitable[Any]]):
+        """Принудительная загрузка свежего значения, в том числе для прогрева кэша"""
+        return await self._load_coalesced(key, loader, use_disk=False)
+
+    async def _load_coalesced(self, key: str, loader: Callable[[], Awaitable[Any]], use_disk: bool = True):
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except _LoadAbandoned:
+                # первый из ожидающих начинает загрузку заново, остальные ждут уже его
+                return await self._load_coalesced(key, loader, use_disk)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await self._load(key, loader, use_disk)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # отмена касается только этого запроса, ожидающих она не должна отменять
+            future.set_exception(_LoadAbandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # помечаем исключение полученным, иначе asyncio пишет предупреждение при отсутствии ожидающих
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], use_disk: bool):
+        if self.disk is not None and use_disk:
+            value, expires = await asyncio.to_thread(self.disk.get, self.name, key)
+            if value is not _MISSING:
+                self.hits += 1
+                self.set(key, value, ttl=expires - time.time())
+                return value
+        self.misses += 1
+        value = await loader()
+        self.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, self.name, key, value, time.time() + self.ttl)
+        return value
+
+    def stats(self) -> dict:
+        """Счетчики попаданий, промахов и вытеснений"""
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "coalesced": self.coalesced, "stale": self.stale}
@@ -0,0 +1,116 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from io import BytesIO
+import numpy as np
+from cache import TTLCache
+from history import History, COLUMNS
+from ledger import DailyLedger
+from config import settings
+
+# Готовые картинки по ключу (пользователь, график, версия данных)
+chart_cache = TTLCache("charts", settings.chart_cache_size, settings.chart_cache_ttl)
+_executor: Executor | None = None
+# Графики по дням: колонка значений, колонка цели и подпись оси
+HISTORY_CHARTS = {"water": ("water", "water_goal", "Мл"), "calories": ("calories", "calorie_goal", "ккал")}
+
+
+def get_executor() -> Executor:
+    """Ограниченный пул для отрисовки, создается при первом графике"""
+    global _executor  # pylint: disable=W0603
+    if _executor is None:
+        if settings.chart_executor == "process":
+            # к первому графику в процессе уже работают потоки (логи, перевод, aiosqlite, сторож loop),
+            # fork многопоточного процесса может зависнуть на чужой блокировке
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                # сервер форков однопоточный, модуль загружается в нем один раз для всех воркеров
+                context.set_forkserver_preload(["charts"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _executor = ProcessPoolExecutor(max_workers=settings.chart_workers, mp_context=context)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=settings.chart_workers, thread_name_prefix="charts")
+    return _executor
+
+
+def shutdown_executor():
+    """Остановка пула отрисовки"""
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def new_figure(**kwargs):
+    """Фигура с холстом Agg; matplotlib тяжелый и нужен редко, поэтому загружается при первом графике в воркере"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # pylint: disable=C0415
+    from matplotlib.figure import Figure  # pylint: disable=C0415
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def render_cumulative(values, title: str, ylabel: str) -> bytes:
+    """Отрисовка накопительного графика в PNG без глобального состояния pyplot"""
+    # график начинается с нуля до первого приема
+    cumulative = np.concatenate(([0], np.cumsum(values)))
+    fig = new_figure()
+    ax = fig.add_subplot()
+    ax.set_title(title)
+    ax.set_xlabel('Прием')
+    ax.set_ylabel(ylabel)
+    ax.set_xticks(range(len(cumulative)))
+    ax.plot(cumulative, marker='o')
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+async def render_chart(user_id: int, kind: str, ledger: DailyLedger, title: str, ylabel: str) -> bytes:
+    """Отрисовка графика в пуле, повторный запрос той же версии данных берется из кэша"""
+    created, changes = ledger.version
+    key = f"{user_id}:{kind}:{created}:{changes}"
+    # копия буфера: пока идет отрисовка в потоке, в исходный массив могут добавить запись
+    values = ledger.amounts[:]
+
+    async def load():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), render_cumulative, values, title, ylabel)
+
+    return await chart_cache.get_or_load(key, load)
+
+
+def render_daily(days, values, goals, title: str, ylabel: str) -> bytes:
+    """Отрисовка итогов по дням с целью и скользящим средним за 7 дней"""
+    dates = [date.fromordinal(int(day)).strftime("%d.%m") for day in days]
+    window = min(7, len(values))
+    rolling = np.convolve(values, np.ones(window) / window, mode="valid")
+    fig = new_figure(figsize=(max(6.4, len(values) * 0.25), 4.8))
+    ax = fig.add_subplot()
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
+    ax.bar(dates, values, label='За день')
+    ax.plot(dates, goals, color='tab:red', label='Цель')
+    ax.plot(dates[window - 1:], rolling, color='tab:green', marker='o', label=f'Среднее за {window} дн.')
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.legend()
+    fig.tight_layout()
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+async def render_history(user_id: int, kind: str, history: History, days: int, today: date, title: str) -> bytes:
+    """Отрисовка недельного или месячного графика из истории с кэшированием по версии истории"""
+    value_column, goal_column, ylabel = HISTORY_CHARTS[kind]
+    key = f"{user_id}:{kind}:{days}:{history.version}"
+    window = history.window(days, today)
+    day = window[COLUMNS.index("day")].copy()
+    values = window[COLUMNS.index(value_column)].copy()
+    goals = window[COLUMNS.index(goal_column)].copy()
+
+    async def load():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), render_daily, day, values, goals, title, ylabel)
+
+    return await chart_cache.get_or_load(key, load)
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from typing import AsyncIterator, Iterable
+import aiohttp
+from aiohttp import web
+from metrics import metrics_view
+from config import settings
+
+logger = logging.getLogger(__name__)
+# Наибольшая пауза между повторами getUpdates при ошибках
+POLLING_MAX_BACKOFF = 60
+
+
+def raw_user_id(update: dict) -> int:
+    """Идентификатор пользователя из необработанного обновления без валидации pydantic"""
+    for key, event in update.items():
+        if key != "update_id" and isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return update["update_id"]
+
+
+def shard(update: dict, workers: int) -> int:
+    """Номер воркера для обновления"""
+    return raw_user_id(update) % workers
+
+
+async def _pause(stop: asyncio.Event, seconds: float):
+    """Пауза, которая прерывается остановкой кластера"""
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except TimeoutError:
+        pass
+
+
+async def polling_source(token: str, stop: asyncio.Event) -> AsyncIterator[dict]:
+    """Long polling getUpdates, обновления отдаются как словари.
+
+    Ошибки Bot API и сети повторяются с растущей паузой до POLLING_MAX_BACKOFF секунд,
+    при 429 - через указанный в ответе retry_after.
+    """
+    base = f"{settings.telegram_api_url or 'https://api.telegram.org'}/bot{token}"
+    offset = None
+    backoff = 1.0
+    async with aiohttp.ClientSession() as client:
+        # с установленным вебхуком getUpdates отвечает 409, обновления приходят только одним способом
+        try:
+            async with client.post(f"{base}/deleteWebhook", timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if not (await response.json()).get("ok"):
+                    logger.warning("Не удалось удалить вебхук: HTTP %s", response.status)
+        except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+            logger.warning("Не удалось удалить вебхук: %r", e)
+        while not stop.is_set():
+            params = {"timeout": 30} if offset is None else {"timeout": 30, "offset": offset}
+            try:
+                async with client.get(f"{base}/getUpdates", params=params,
+                                      timeout=aiohttp.ClientTimeout(total=40)) as response:
+                    data = await response.json()
+            except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+                logger.warning("getUpdates не выполнен: %r, повтор через %s с", e, backoff)
+                await _pause(stop, backoff)
+                backoff = min(backoff * 2, POLLING_MAX_BACKOFF)
+                continue
+            if not data.get("ok"):
+                retry_after = data.get("parameters", {}).get("retry_after")
+                delay = retry_after if retry_after is not None else backoff
+                logger.warning("getUpdates: %s %s, повтор через %s с", data.get("error_code"),
+                               data.get("description"), delay)
+                await _pause(stop, delay)
+                if retry_after is None:
+                    backoff = min(backoff * 2, POLLING_MAX_BACKOFF)
+                continue
+            backoff = 1.0
+            for update in data.get("result", []):
+                offset = update["update_id"] + 1
+                yield update
+
+
+async def fake_source(updates: Iterable[dict], stop: asyncio.Event, delay: float = 0) -> AsyncIterator[dict]:
+    """Тестовый источник обновлений для локальной проверки"""
+    for update in updates:
+        if stop.is_set():
+            return
+        yield update
+        if delay:
+            await asyncio.sleep(delay)
+
+
+async def _serve_health(index: int, stats: dict, add_routes=None) -> web.AppRunner | None:
+    """Эндпоинты /health, /metrics и диагностики воркера на порту CLUSTER_HEALTH_PORT + номер воркера"""
+    if not settings.cluster_health_port:
+        return None
+
+    async def health(_request: web.Request) -> web.Response:
+        return web.json_response({**stats, "uptime": round(time.monotonic() - stats["started"], 1)})
+
+    app = web.Application()
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics_view)
+    if add_routes is not None:
+        add_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", settings.cluster_health_port + index).start()
+    return runner
+
+
+async def _worker_main(index: int, workers: int, queue: multiprocessing.Queue):
+    # pylint: disable=C0415
+    from aiogram.types import Update
+    from bot import bot, dp
+    from webhook import UpdateQueue
+
+    stats = {"worker": index, "received": 0, "queued": 0, "started": time.monotonic()}
+    # общий порт METRICS_PORT заняли бы все воркеры сразу, метрики отдаются вместе с /health
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot], metrics_port=0, shard=(index, workers))
+    updates = UpdateQueue(dp, bot, settings.webhook_workers, settings.webhook_queue_size)
+    updates.start()
+    diagnostics = dp.workflow_data.get("diagnostics")
+    health = await _serve_health(index, stats, diagnostics.add_routes if diagnostics else None)
+    try:
+        while True:
+            raw = await asyncio.to_thread(queue.get)
+            if raw is None:
+                break
+            stats["received"] += 1
+            await updates.put(Update.model_validate(json.loads(raw), context={"bot": bot}), timeout=None)
+            stats["queued"] = updates.qsize()
+    finally:
+        await updates.drain(settings.cluster_drain_timeout)
+        if health is not None:
+            await health.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+        await bot.session.close()
+
+
+def run_worker(index: int, workers: int, queue: multiprocessing.Queue):
+    """Точка входа процесса воркера"""
+    # остановкой управляет главный процесс через сигнальное значение None в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, workers, queue))
+
+
+async def run_cluster(source_factory, workers: int = settings.cluster_workers):
+    """Запуск воркеров и распределение обновлений по хэшу from_user.id.
+
+    Состояние и порядок сообщений пользователя всегда остаются в одном процессе.
+    """
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=settings.cluster_queue_size) for _ in range(workers)]
+    processes = [context.Process(target=run_worker, args=(index, workers, queue), name=f"bot-worker-{index}")
+                 for index, queue in enumerate(queues)]
+    for process in processes:
+        process.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        async for update in source_factory(stop):
+            # put блокирует при заполненной очереди воркера, это и есть обратное давление
+            await asyncio.to_thread(queues[shard(update, workers)].put, json.dumps(update))
+    finally:
+        for queue in queues:
+            await asyncio.to_thread(queue.put, None)
+        for process in processes:
+            await asyncio.to_thread(process.join, settings.cluster_drain_timeout + 5)
+            if process.is_alive():
+                process.terminate()
+
+
+def main():
+    """Запуск кластера из командной строки"""
+    parser = argparse.ArgumentParser(description="Запуск бота несколькими процессами")
+    parser.add_argument("--workers", type=int, default=settings.cluster_workers)
+    parser.add_argument("--fake-updates", help="файл с обновлениями в формате JSON lines вместо Telegram")
+    args = parser.parse_args()
+
+    if args.fake_updates:
+        with open(args.fake_updates, encoding="utf-8") as file:
+            updates = [json.loads(line) for line in file if line.strip()]
+
+        def source_factory(stop):
+            return fake_source(updates, stop)
+    else:
+        def source_factory(stop):
+            return polling_source(settings.bot_token, stop)
+
+    print(f"Кластер из {args.workers} воркеров запущен!")
+    asyncio.run(run_cluster(source_factory, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,262 @@
 import os
+from dataclasses import dataclass, field, fields
+from datetime import time
+from typing import ClassVar
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from dotenv import load_dotenv
 
 # Загрузка переменных из .env файла
 load_dotenv()
 
-# Чтение токена из переменной окружения
-TOKEN = os.getenv("BOT_TOKEN")
-WEATHER_TOKEN = os.getenv("WEATHER_TOKEN")
-FOOD_ID = os.getenv("NUTRITIONIX_ID")
-FOOD_TOKEN = os.getenv("NUTRITIONIX_TOKEN")
-
-if not TOKEN:
-    raise ValueError("Переменная окружения BOT_TOKEN не установлена!")
-if not WEATHER_TOKEN:
-    raise ValueError("Переменная окружения WEATHER_TOKEN не установлена!")
-if not FOOD_ID:
-    raise ValueError("Переменная окружения NUTRITIONIX_ID не установлена!")
-if not FOOD_TOKEN:
-    raise ValueError("Переменная окружения NUTRITIONIX_TOKEN не установлена!")
+_TRUE, _FALSE = ("1", "true", "yes", "on"), ("0", "false", "no", "off", "")
+
+
+def _parse(kind, raw: str):
+    """Преобразование значения переменной окружения к типу поля настроек"""
+    if kind is bool:
+        if raw.strip().lower() not in _TRUE + _FALSE:
+            raise ValueError("ожидается 1 или 0")
+        return raw.strip().lower() in _TRUE
+    if kind in (int, float):
+        return kind(raw)
+    if kind == set[int]:
+        return {int(item) for item in raw.split(",") if item.strip()}
+    if kind == dict[str, float]:
+        costs = {}
+        for item in filter(None, (item.strip() for item in raw.split(","))):
+            name, separator, cost = item.partition(":")
+            if not separator:
+                raise ValueError(f"ожидается имя:число, получено {item!r}")
+            costs[name.strip()] = float(cost)
+        return costs
+    if kind == time | None:
+        return time.fromisoformat(raw) if raw else None
+    return raw
+
+
+@dataclass(frozen=True)
+class Settings:  # pylint: disable=R0902
+    """Все настройки бота из переменных окружения с именами полей в верхнем регистре.
+
+    Значения проверяются при запуске, ошибки собираются в одно сообщение. Без токена внешнего
+    API бот запускается, а зависящая от него функция отключается.
+    """
+    # Токены: без BOT_TOKEN бот не запускается, остальные включают погоду и Nutritionix
+    bot_token: str = ""
+    weather_token: str = ""
+    nutritionix_id: str = ""
+    nutritionix_token: str = ""
+
+    # Настройки общего HTTP-клиента для внешних API
+    http_timeout: float = 10
+    http_connect_timeout: float = 3
+    http_pool_limit: int = 100
+    http_pool_limit_per_host: int = 20
+    http_keepalive: float = 30
+    http_dns_ttl: int = 300
+
+    # Устойчивость внешних API: дедлайн вызова с повторами, число повторов и базовая пауза между ними,
+    # порог ошибок подряд и время, на которое после него размыкается автомат
+    api_deadline: float = 8
+    api_retries: int = 2
+    api_backoff: float = 0.3
+    api_breaker_failures: int = 5
+    api_breaker_reset: float = 30
+    # Лимиты частоты запросов в секунду и допустимый всплеск под квоты провайдеров, 0 - без ограничения;
+    # квота на весь бот, cluster.py делит ее поровну между воркерами
+    nutritionix_rate: float = 2
+    nutritionix_burst: float = 5
+    weather_rate: float = 1
+    weather_burst: float = 10
+    # Адреса внешних API, переопределяются для нагрузочного теста (bench.py) и локальных заглушек;
+    # пустой TRANSLATE_API_URL - адрес по умолчанию библиотеки translate
+    nutritionix_api_url: str = "https://trackapi.nutritionix.com"
+    weather_api_url: str = "http://api.openweathermap.org"
+    translate_api_url: str = ""
+
+    # Кэш ответов Nutritionix, пустой CACHE_DB_PATH отключает дисковый уровень
+    cache_db_path: str = ""
+    food_cache_size: int = 5000
+    food_cache_ttl: float = 7 * 24 * 3600
+
+    # Перевод: размер и время жизни кэша, число потоков и таймаут обращения к внешнему переводчику
+    translate_cache_size: int = 10000
+    translate_cache_ttl: float = 7 * 24 * 3600
+    translate_workers: int = 4
+    translate_timeout: float = 5
+
+    # Отрисовка графиков: тип пула (process или thread), число воркеров и кэш готовых картинок
+    chart_executor: str = "process"
+    chart_workers: int = 2
+    chart_cache_size: int = 1000
+    chart_cache_ttl: float = 3600
+
+    # Хранилище пользователей: memory, sqlite или redis
+    storage_backend: str = "memory"
+    storage_path: str = "users.db"
+    storage_flush_interval: float = 1
+    # Кэш пользователей SQLite: наибольший размер и время, после которого неиспользуемая запись вытесняется
+    storage_cache_size: int = 10000
+    storage_cache_idle: float = 300
+    redis_url: str = "redis://localhost:6379/0"
+
+    # Хранилище состояний анкеты (FSM): memory, sqlite или redis, FSM_TTL - время жизни брошенной анкеты
+    fsm_storage: str = "memory"
+    fsm_storage_path: str = "fsm.db"
+    fsm_ttl: float = 24 * 3600
+
+    # Режим получения обновлений: polling (по умолчанию) или webhook
+    run_mode: str = "polling"
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret: str = ""
+    webhook_queue_size: int = 1000
+    webhook_workers: int = 32
+    # Обработчиков на очередь: обновления пользователя идут по порядку, остальные пользователи очереди не ждут
+    webhook_shard_workers: int = 4
+    webhook_enqueue_timeout: float = 1
+
+    # Адрес Bot API, пустое значение - официальный сервер Telegram
+    telegram_api_url: str = ""
+
+    # Запуск несколькими процессами (cluster.py)
+    cluster_workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    cluster_queue_size: int = 1000
+    cluster_health_port: int = 9100
+    cluster_drain_timeout: float = 30
+
+    # Кэш погоды: время свежести, время отдачи устаревшего значения и ежедневный прогрев (ЧЧ:ММ, пусто - выключен)
+    weather_cache_ttl: float = 1800
+    weather_stale_ttl: float = 6 * 3600
+    weather_prefetch_at: time | None = time(6, 30)
+    # Прогреваются города пользователей, обращавшихся к боту за последние WEATHER_ACTIVE_DAYS дней
+    weather_active_days: float = 7
+    weather_prefetch_concurrency: int = 10
+
+    # Логирование и метрики: доля логируемых сообщений, уровень лога, порт /metrics (0 - выключен)
+    log_sample_rate: float = 0.1
+    log_level: str = "INFO"
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9090
+
+    # Ограничение частоты запросов пользователя: токенов в секунду, емкость ведра и стоимость обработчиков
+    # (имя:стоимость через запятую, остальные стоят 1), окно отброса одинаковых сообщений в секундах и
+    # число одновременно выполняемых дорогих обработчиков (стоимость больше 1); THROTTLE_RATE=0 - выключено
+    throttle_rate: float = 1
+    throttle_burst: float = 10
+    throttle_costs: dict[str, float] = field(default_factory=lambda: {
+        "plot_water": 5, "plot_calories": 5, "log_food": 3, "log_workout": 3, "new_day": 2, "stats": 2})
+    throttle_dedup_window: float = 2
+    throttle_expensive_concurrency: int = 8
+
+    # Диагностика: задержка event loop, стеки блокировок дольше DIAG_BLOCK_THRESHOLD секунд и профилировщик
+    # по запросу (/debug/lag и /debug/profile на сервере метрик, команды /lag и /profile для ADMIN_IDS)
+    diag_enabled: bool = False
+    diag_lag_interval: float = 0.1
+    diag_block_threshold: float = 0.25
+    diag_profile_hz: float = 100
+    diag_profile_max_seconds: float = 60
+    admin_ids: set[int] = field(default_factory=set)
+
+    # Максимум записей за день, после него записи сворачиваются в почасовые
+    ledger_max_entries: int = 200
+
+    # Автоматическая смена дня в полночь по часовому поясу пользователя
+    default_timezone: str = "Europe/Moscow"
+    rollover_enabled: bool = True
+    rollover_batch_size: int = 100
+    rollover_prepare_ahead: float = 3600
+
+    # Локальная база калорийности и MET: встроенный набор данных и файл базы
+    # (пусто - в памяти, без сохранения ответов API)
+    nutrition_dataset: str = os.path.join(os.path.dirname(__file__), "nutrition.csv")
+    nutrition_db_path: str = ""
+
+    # Допустимые значения строковых настроек
+    CHOICES: ClassVar[dict[str, tuple[str, ...]]] = {
+        "run_mode": ("polling", "webhook"),
+        "chart_executor": ("process", "thread"),
+        "storage_backend": ("memory", "sqlite", "redis"),
+        "fsm_storage": ("memory", "sqlite", "redis"),
+        "log_level": ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+    }
+    # Числа, которые должны быть больше нуля, остальные - не меньше нуля
+    POSITIVE: ClassVar[tuple[str, ...]] = (
+        "http_timeout", "http_connect_timeout", "api_deadline", "api_breaker_failures", "api_breaker_reset",
+        "translate_cache_ttl", "translate_workers", "translate_timeout", "chart_workers", "storage_flush_interval",
+        "storage_cache_size", "webhook_queue_size", "webhook_workers", "webhook_shard_workers", "cluster_workers",
+        "cluster_queue_size", "diag_lag_interval", "diag_block_threshold", "diag_profile_hz",
+        "diag_profile_max_seconds", "ledger_max_entries", "rollover_batch_size", "weather_prefetch_concurrency",
+        "throttle_burst", "throttle_expensive_concurrency",
+    )
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Чтение и проверка настроек, ValueError со списком всех ошибок"""
+        values, errors = {}, []
+        for setting in fields(cls):
+            name = setting.name.upper()
+            raw = os.getenv(name)
+            if raw is None:
+                continue
+            try:
+                values[setting.name] = _parse(setting.type, raw)
+            except ValueError as e:
+                errors.append(f"{name}={raw!r}: {e}")
+        settings = cls(**values)
+        errors += settings.problems()
+        if errors:
+            raise ValueError("Ошибки в настройках:\n" + "\n".join(errors))
+        return settings
+
+    def problems(self) -> list[str]:
+        """Недопустимые значения и недостающие обязательные настройки"""
+        problems = []
+        if not self.bot_token:
+            problems.append("Переменная окружения BOT_TOKEN не установлена!")
+        if self.run_mode == "webhook" and not self.webhook_url:
+            problems.append("Переменная окружения WEBHOOK_URL не установлена!")
+        if self.run_mode == "webhook" and not self.webhook_secret:
+            problems.append("Переменная окружения WEBHOOK_SECRET не установлена!")
+        for name, choices in self.CHOICES.items():
+            if getattr(self, name) not in choices:
+                problems.append(f"{name.upper()}={getattr(self, name)!r}: ожидается одно из {', '.join(choices)}")
+        for setting in fields(self):
+            value = getattr(self, setting.name)
+            if setting.type not in (int, float):
+                continue
+            if value < 0 or (value == 0 and setting.name in self.POSITIVE):
+                bound = "больше нуля" if setting.name in self.POSITIVE else "не меньше нуля"
+                problems.append(f"{setting.name.upper()}={value}: должно быть {bound}")
+        if not 0 <= self.log_sample_rate <= 1:
+            problems.append(f"LOG_SAMPLE_RATE={self.log_sample_rate}: должно быть от 0 до 1")
+        try:
+            ZoneInfo(self.default_timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            problems.append(f"DEFAULT_TIMEZONE={self.default_timezone!r}: неизвестный часовой пояс")
+        return problems
+
+    @property
+    def weather_enabled(self) -> bool:
+        """Погода для нормы воды, без нее норма считается без поправки на жару"""
+        return bool(self.weather_token)
+
+    @property
+    def nutritionix_enabled(self) -> bool:
+        """Nutritionix для продуктов и тренировок, которых нет в локальной базе"""
+        return bool(self.nutritionix_id and self.nutritionix_token)
+
+    def disabled_features(self) -> list[str]:
+        """Отключенные из-за отсутствующих токенов функции для предупреждения при запуске"""
+        disabled = []
+        if not self.weather_enabled:
+            disabled.append("погода в норме воды (нет WEATHER_TOKEN)")
+        if not self.nutritionix_enabled:
+            disabled.append("Nutritionix, только локальная база питания (нет NUTRITIONIX_ID или NUTRITIONIX_TOKEN)")
+        return disabled
+
+
+settings = Settings.from_env()
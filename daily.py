@@ -0,0 +1,53 @@
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+from aiohttp import ClientSession
+from config import settings
+from history import History
+from ledger import DailyLedger
+from translation import translate
+from upstream import UpstreamError
+from weather import get_temp
+
+
+def user_timezone(user: dict) -> ZoneInfo:
+    """Часовой пояс из профиля пользователя"""
+    return ZoneInfo(user.get("timezone", settings.default_timezone))
+
+
+def local_today(user: dict) -> date:
+    """Текущая дата в часовом поясе пользователя"""
+    return datetime.now(user_timezone(user)).date()
+
+
+def base_water_goal(user: dict) -> float:
+    """Норма воды без учета погоды"""
+    return user["age"]*30 + round(user["activity"]*500, 0)
+
+
+async def compute_water_goal(client: ClientSession, user: dict) -> float:
+    """Норма воды с учетом температуры в городе пользователя, без погоды - если она недоступна"""
+    city = await translate(user["city"])
+    try:
+        temp = await get_temp(client, city)//25
+    except UpstreamError:
+        return base_water_goal(user)
+    return base_water_goal(user) + temp*250
+
+
+def archive_day(user: dict):
+    """Перенос итогов прошедшего дня в историю пользователя"""
+    if "date" not in user:
+        return
+    history = user.setdefault("history", History())
+    history.append(date.fromisoformat(user["date"]), user["logged_water"].total, user["water_goal"],
+                   user["logged_calories"].total, user["calorie_goal"], user["burned_calories"])
+
+
+def start_day(user: dict, day: date, water_goal: float):
+    """Архивирование прошлого дня и начало нового с пустыми записями"""
+    archive_day(user)
+    user["date"] = day.isoformat()
+    user["logged_water"] = DailyLedger()
+    user["logged_calories"] = DailyLedger()
+    user["burned_calories"] = 0
+    user["water_goal"] = water_goal
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from aiohttp import web
+from metrics import loop_lag, loop_blocked, startup_seconds, resident_memory
+
+logger = logging.getLogger(__name__)
+
+# Модули, которые загружаются только при первом использовании; если они есть после запуска, ленивость сломана
+LAZY_MODULES = ("matplotlib", "translate", "redis")
+
+
+def process_uptime() -> float | None:
+    """Секунды с запуска процесса по /proc (Linux), None на других системах"""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as file:
+            stat = file.read()
+        with open("/proc/uptime", encoding="ascii") as file:
+            uptime = float(file.read().split()[0])
+    except OSError:
+        return None
+    # имя процесса в скобках может содержать пробелы, starttime - 20-е поле после него
+    start = int(stat.rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+    return round(max(0.0, uptime - start), 2)
+
+
+def resident_bytes() -> int:
+    """Текущая резидентная память процесса, без /proc - пиковая"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource  # pylint: disable=C0415
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def startup_report(imported: float | None) -> dict:
+    """Отчет о стоимости запуска: время импорта и инициализации, память, загруженные модули.
+
+    imported - process_uptime() сразу после импортов главного модуля. Подробная разбивка
+    по модулям - python -X importtime bot.py.
+    """
+    rss = resident_bytes()
+    report = {"imports": imported, "ready": process_uptime(), "rss_mb": round(rss / 2 ** 20, 1),
+              "modules": len(sys.modules), "lazy_loaded": [name for name in LAZY_MODULES if name in sys.modules]}
+    for stage in ("imports", "ready"):
+        if report[stage] is not None:
+            startup_seconds.set(stage, value=report[stage])
+    resident_memory.set(value=rss)
+    logger.info("Запуск: импорт %s с, готов через %s с, память %s МБ, модулей %s, заранее загружены %s",
+                report["imports"], report["ready"], report["rss_mb"], report["modules"],
+                ", ".join(report["lazy_loaded"]) or "нет", extra={"startup": report})
+    return report
+
+
+def collapse_stack(frame) -> str:
+    """Стек в формате collapsed (flamegraph.pl, speedscope): кадры от внешнего к внутреннему через ;"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Diagnostics:
+    """Задержка event loop, стеки блокирующих вызовов и выборочный профилировщик.
+
+    Пульс в loop раз в interval секунд обновляет метку времени, отдельный поток проверяет ее
+    и при простое дольше threshold один раз за эпизод снимает стек потока loop. Профилировщик
+    работает только по запросу и снимает стек потока loop hz раз в секунду, поэтому в обычном
+    режиме стоимость - одна задача с sleep и один спящий поток.
+    """
+
+    def __init__(self, interval: float, threshold: float, hz: float, max_seconds: float, keep: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.hz = hz
+        self.max_seconds = max_seconds
+        self.blocked: deque[dict] = deque(maxlen=keep)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._stop = threading.Event()
+        self._profile_lock = asyncio.Lock()
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Запуск пульса и сторожевого потока для текущего loop"""
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        """Остановка пульса и сторожевого потока"""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - start - self.interval)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            loop_lag.observe(value=self.last_lag)
+            self._beat = time.monotonic()
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or reported == beat:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)  # pylint: disable=W0212
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.blocked.append({"at": round(time.time(), 3), "stalled": round(stalled, 3), "stack": stack})
+            loop_blocked.inc()
+            logger.warning("Event loop заблокирован дольше %.3f с", stalled, extra={"stack": stack})
+
+    def _sample(self, seconds: float) -> Counter:
+        stacks: Counter = Counter()
+        interval = 1 / self.hz
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._loop_thread)  # pylint: disable=W0212
+            if frame is not None:
+                # loop ждет ввода-вывода в селекторе, то есть простаивает
+                idle = os.path.basename(frame.f_code.co_filename) == "selectors.py"
+                stacks["[idle]" if idle else collapse_stack(frame)] += 1
+            time.sleep(interval)
+        return stacks
+
+    async def profile(self, seconds: float) -> str:
+        """Профиль потока loop за seconds секунд в формате collapsed stacks, одновременно идет один замер"""
+        seconds = min(max(seconds, 1 / self.hz), self.max_seconds)
+        async with self._profile_lock:
+            stacks = await asyncio.to_thread(self._sample, seconds)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def report(self) -> dict:
+        """Задержка loop и последние эпизоды блокировки"""
+        return {"interval": self.interval, "threshold": self.threshold, "last_lag": round(self.last_lag, 4),
+                "max_lag": round(self.max_lag, 4), "blocked": list(self.blocked)}
+
+    async def lag_view(self, _request: web.Request) -> web.Response:
+        """Обработчик GET /debug/lag"""
+        return web.json_response(self.report())
+
+    async def profile_view(self, request: web.Request) -> web.Response:
+        """Обработчик GET /debug/profile?seconds=N"""
+        try:
+            seconds = float(request.query.get("seconds", "10"))
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds должно быть числом") from None
+        return web.Response(text=await self.profile(seconds), content_type="text/plain", charset="utf-8")
+
+    def add_routes(self, app: web.Application):
+        """Эндпоинты диагностики на локальном HTTP-сервере метрик"""
+        app.router.add_get("/debug/lag", self.lag_view)
+        app.router.add_get("/debug/profile", self.profile_view)
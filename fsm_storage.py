@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+from typing import Any, Mapping
+import aiosqlite
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import settings
+
+
+def dumps(data: Mapping[str, Any]) -> str:
+    """Компактная сериализация данных состояния"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в SQLite, незавершенные анкеты удаляются через ttl секунд бездействия"""
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._db: aiosqlite.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._last_purge = 0.0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Подключение к базе при первом обращении"""
+        async with self._lock:
+            if self._db is None:
+                db = await aiosqlite.connect(self.path)
+                await db.executescript(
+                    "PRAGMA journal_mode=WAL;"
+                    "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT, expires REAL);"
+                    "CREATE INDEX IF NOT EXISTS ix_fsm_expires ON fsm (expires);"
+                )
+                await db.commit()
+                self._db = db
+        return self._db
+
+    async def _write(self, sql: str, params: tuple):
+        db = await self._connect()
+        now = time.time()
+        await db.execute(sql, params)
+        # просроченные анкеты чистим не чаще раза в минуту
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            await db.execute("DELETE FROM fsm WHERE expires < ?", (now,))
+        await db.commit()
+
+    async def _read(self, key: StorageKey, column: str):
+        db = await self._connect()
+        async with db.execute(f"SELECT {column} FROM fsm WHERE key = ? AND expires >= ?",
+                              (self.key_builder.build(key), time.time())) as cursor:
+            row = await cursor.fetchone()
+        return None if row is None else row[0]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._write("INSERT INTO fsm (key, state, data, expires) VALUES (?, ?, '{}', ?) "
+                          "ON CONFLICT (key) DO UPDATE SET state = excluded.state, expires = excluded.expires",
+                          (self.key_builder.build(key), state, time.time() + self.ttl))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return await self._read(key, "state")
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        await self._write("INSERT INTO fsm (key, state, data, expires) VALUES (?, NULL, ?, ?) "
+                          "ON CONFLICT (key) DO UPDATE SET data = excluded.data, expires = excluded.expires",
+                          (self.key_builder.build(key), dumps(data), time.time() + self.ttl))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        data = await self._read(key, "data")
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Создание хранилища FSM по переменной окружения FSM_STORAGE"""
+    if settings.fsm_storage == "sqlite":
+        return SQLiteStorage(settings.fsm_storage_path, settings.fsm_ttl)
+    if settings.fsm_storage == "redis":
+        # redis нужен только для этого варианта, поэтому импортируется здесь
+        from aiogram.fsm.storage.redis import RedisStorage  # pylint: disable=C0415
+        ttl = int(settings.fsm_ttl)
+        return RedisStorage.from_url(settings.redis_url, state_ttl=ttl, data_ttl=ttl)
+    return MemoryStorage()
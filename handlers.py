@@ -1,73 +1,100 @@
+import re
 from typing import Optional
-import matplotlib.pyplot as plt
-import numpy as np
-from aiogram import Router
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from aiogram import F, Router
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from states import Form
-import aiohttp
+from keyboards import ActivityCallback, SexCallback, ACTIVITY_KEYBOARD, ACTIVITY_LEVELS, LEGACY_CALLBACKS, SEX_KEYBOARD
+from aiohttp import ClientResponse, ClientSession
 from pydantic import BaseModel, Field, ValidationError
-from translate import Translator
-from config import WEATHER_TOKEN, FOOD_ID, FOOD_TOKEN
-
-translator = Translator(to_lang="en", from_lang="ru")
-
-
-async def translate(text: str):
-    """Функция перевода с русского на английский язык"""
-    return translator.translate(text)
-
-
-async def get_temp(selected_city: str):
-    """Функция получения температуры"""
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={selected_city}&appid={WEATHER_TOKEN}&units=metric"
-    async with aiohttp.ClientSession() as client:
-        response = await client.get(url)
-        if response.status == 200:
-            response = await response.json()
-            return response['main']['temp']
-        return await response.text
-
-
-async def get_food(food: str):
-    """Функция получения калорийности продукта"""
-    url = "https://trackapi.nutritionix.com/v2/natural/nutrients"
+from cache import TTLCache, DiskTier, normalize_query
+from charts import render_chart, render_history
+from diagnostics import Diagnostics
+from daily import compute_water_goal, local_today, start_day, user_timezone
+from nutrition import NutritionDB
+from scheduler import RolloverScheduler
+from storage import UserStore
+from translation import translate
+from upstream import NotFound, Upstream, UpstreamError
+from config import settings
+
+# Кэш ответов Nutritionix, при заданном CACHE_DB_PATH переживает перезапуск
+cache_disk = DiskTier(settings.cache_db_path) if settings.cache_db_path else None
+food_cache = TTLCache("foods", settings.food_cache_size, settings.food_cache_ttl, cache_disk)
+train_cache = TTLCache("train", settings.food_cache_size, settings.food_cache_ttl, cache_disk)
+nutritionix = Upstream("nutritionix", settings.nutritionix_rate, settings.nutritionix_burst, settings.api_deadline,
+                       settings.api_retries, settings.api_backoff, settings.api_breaker_failures,
+                       settings.api_breaker_reset, enabled=settings.nutritionix_enabled)
+# Ответы пользователю при ошибках Nutritionix
+NOT_FOUND_FOOD = "К сожалению такого продукта в нашей базе еще нет."
+NOT_FOUND_TRAIN = "К сожалению такой тренировки в нашей базе нет."
+UNAVAILABLE = "Сервис калорийности сейчас недоступен, попробуйте позже."
+
+
+async def get_foods(client: ClientSession, nutrition: NutritionDB, query: str) -> list[dict]:
+    """Функция получения продуктов запроса: локальная база, затем кэш и Nutritionix"""
+    foods = nutrition.find_foods(query)
+    if foods is not None:
+        return foods
+    return await food_cache.get_or_load(normalize_query(query), lambda: fetch_foods(client, nutrition, query))
+
+
+async def fetch_foods(client: ClientSession, nutrition: NutritionDB, query: str) -> list[dict]:
+    """Запрос калорийности всех продуктов фразы в Nutritionix одним вызовом"""
+    url = f"{settings.nutritionix_api_url}/v2/natural/nutrients"
     headers = {
-        'x-app-id': FOOD_ID,
-        'x-app-key': FOOD_TOKEN,
+        'x-app-id': settings.nutritionix_id,
+        'x-app-key': settings.nutritionix_token,
         'Content-Type': 'application/json'
     }
-    data = {"query": food}
-
-    async with aiohttp.ClientSession() as client:
-        async with client.post(url, headers=headers, json=data) as response:
-            if response.status == 200:
-                nutrients = await response.json()
-                calories = nutrients['foods'][0]['nf_calories']
-                serving_gramm = nutrients['foods'][0]['serving_weight_grams']
-                calories_for_gramm = round(calories / serving_gramm, 2)
-                return calories_for_gramm
-            return await "К сожалению такого продукта в нашей базе еще нет."
-
-
-async def get_train_cal(train: str, time: int):
-    """Функция получения каллорийности с тренировки"""
-    url = "https://trackapi.nutritionix.com/v2/natural/exercise"
+    data = {"query": query}
+
+    async def parse(response: ClientResponse) -> list[dict]:
+        nutrients = await response.json()
+        # без веса порции калории не пересчитать на граммы, такие продукты пропускаются, как в remember_foods
+        foods = [food for food in nutrients.get('foods') or []
+                 if food.get('serving_weight_grams') and food.get('nf_calories') is not None]
+        if not foods:
+            raise NotFound("nutritionix", NOT_FOUND_FOOD)
+        await nutrition.remember_foods(foods)
+        return [{"name": food['food_name'], "calories": food['nf_calories'],
+                 "gramms": food['serving_weight_grams']} for food in foods]
+
+    # ошибки не кэшируются, поэтому повторный запрос снова уйдет в API
+    return await nutritionix.request(client, "POST", url, parse, headers=headers, json=data)
+
+
+async def get_train_cal(client: ClientSession, nutrition: NutritionDB, train: str, time: int,
+                        weight: float) -> float:
+    """Функция получения каллорийности с тренировки: локальная база по MET, затем кэш и Nutritionix"""
+    calories = nutrition.exercise_calories(train, time, weight)
+    if calories is not None:
+        return calories
+    return await train_cache.get_or_load(normalize_query(f"{train} {time} {weight}"),
+                                         lambda: fetch_train_cal(client, nutrition, train, time, weight))
+
+
+async def fetch_train_cal(client: ClientSession, nutrition: NutritionDB, train: str, time: int,
+                          weight: float) -> float:
+    """Запрос каллорийности тренировки в Nutritionix"""
+    url = f"{settings.nutritionix_api_url}/v2/natural/exercise"
     headers = {
-        'x-app-id': FOOD_ID,
-        'x-app-key': FOOD_TOKEN,
+        'x-app-id': settings.nutritionix_id,
+        'x-app-key': settings.nutritionix_token,
         'Content-Type': 'application/json'
     }
-    data = {"query": f"{train} {time}"}
+    data = {"query": f"{train} {time}", "weight_kg": weight}
+
+    async def parse(response: ClientResponse) -> float:
+        exercise = await response.json()
+        if not exercise.get('exercises'):
+            raise NotFound("nutritionix", NOT_FOUND_TRAIN)
+        await nutrition.remember_exercise(exercise['exercises'][0])
+        return exercise['exercises'][0]['nf_calories']
 
-    async with aiohttp.ClientSession() as client:
-        async with client.post(url, headers=headers, json=data) as response:
-            if response.status == 200:
-                exercise = await response.json()
-                calories = exercise['exercises'][0]['nf_calories']
-                return calories
-            return await "К сожалению такой тренировки в нашей базе нет."
+    return await nutritionix.request(client, "POST", url, parse, headers=headers, json=data)
 
 
 class ProfileData(BaseModel):
@@ -84,7 +111,11 @@ class ProfileData(BaseModel):
 
 
 router = Router()
-users = {}
+
+# Количество в запросе, например "2 яйца и 100г риса": шаг с вводом грамм не нужен
+INLINE_QUANTITY = re.compile(r"\d")
+# Периоды графиков по дням для /plot_water и /plot_calories
+PLOT_PERIODS = {"week": 7, "неделя": 7, "month": 30, "месяц": 30}
 
 
 @router.message(Command("start"))
@@ -95,24 +126,17 @@ async def cmd_start(message: Message):
 
 
 @router.message(Command("new_day"))
-async def new_day(message: Message):
+async def new_day(message: Message, http: ClientSession, store: UserStore):
     """Обработчик команды /new_day"""
     user_id = message.from_user.id
     try:
-        city = users[user_id]['city']
-        age = users[user_id]["age"]
-        activity = users[user_id]["activity"]
-        users[user_id]["logged_water"] = [0]
-        users[user_id]["logged_calories"] = [0]
-        users[user_id]["burned_calories"] = 0
-        city = await translate(city)
-        temp = await get_temp(city)//25
-        weather_water = temp*250
-        users[user_id]["water_goal"] = age*30 + round(activity*500, 0) + weather_water
+        user = await store.get(user_id)
+        start_day(user, local_today(user), await compute_water_goal(http, user))
+        await store.save(user_id, user)
         await message.reply("Вот и новый день и я готов записывать ваши результаты!\n"
                             "Сегодня вам нужно:\n"
-                            f"- выпить {users[user_id]["water_goal"]} мл воды.\n"
-                            f"- съесть {users[user_id]["calorie_goal"]} ккал.")
+                            f"- выпить {user["water_goal"]} мл воды.\n"
+                            f"- съесть {user["calorie_goal"]} ккал.")
     except KeyError:
         await message.reply("Нет информации, пожалуйста заполните профиль /set_profile и повторите попытку")
 
@@ -122,59 +146,101 @@ async def cmd_help(message: Message):
     """Обработчик команды /help"""
     await message.reply(
         "Доступные команды:\n"
-        "/new_day - Сброс учитываемых калорий и воды за день\n"
+        "/new_day - Сброс учитываемых калорий и воды за день (происходит сам в полночь)\n"
+        "/timezone - Часовой пояс для смены дня\n"
         "/set_profile - Создание профиля\n"
         "/check_progress - Информация из профиля\n"
         "/log_water - Запись выпитой воды\n"
-        "/log_food - Запись съеденой еды\n"
+        "/log_food - Запись съеденой еды, можно весь прием пищи: /log_food 2 яйца и 100г риса\n"
         "/log_workout - Запись тренировок\n"
-        "/plot_water - график учета воды\n"
-        "/plot_calories - график учета калорий\n"
+        "/plot_water - график учета воды, /plot_water неделя или месяц - по дням\n"
+        "/plot_calories - график учета калорий, /plot_calories неделя или месяц - по дням\n"
+        "/stats - статистика за неделю и месяц\n"
     )
 
 
 @router.message(Command("plot_water"))
-async def plot_water(message: Message):
+async def plot_water(message: Message, command: CommandObject, store: UserStore):
     """Функция построения графика воды"""
     user_id = message.from_user.id
     try:
-        water = users[user_id]['logged_water']
-        water = np.cumsum(water)
-        plt.title('Накопительный учет воды')
-        plt.xlabel('Прием')
-        plt.ylabel('Мл')
-        plt.xticks(range(len(water)))
-        plt.plot(water, marker='o')
-        plt.savefig('water.png')
-        plt.close()
-        photo = FSInputFile("./water.png")
+        user = await store.get(user_id)
+        if command.args:
+            await plot_history(message, user, "water", command.args, 'Вода по дням')
+            return
+        water = user['logged_water']
+        image = await render_chart(user_id, "water", water, 'Накопительный учет воды', 'Мл')
+        photo = BufferedInputFile(image, filename="water.png")
         await message.reply_photo(photo=photo)
     except KeyError:
         await message.reply("Нет информации, пожалуйста заполните профиль /set_profile и повторите попытку")
 
 
 @router.message(Command("plot_calories"))
-async def plot_calories(message: Message):
+async def plot_calories(message: Message, command: CommandObject, store: UserStore):
     """Функция построения графика калорий"""
     user_id = message.from_user.id
     try:
-        calories = users[user_id]['logged_calories']
-        calories = np.cumsum(calories)
-        plt.title('Накопительный учет калорий')
-        plt.xlabel('Прием')
-        plt.ylabel('ккал')
-        plt.xticks(range(len(calories)))
-        plt.plot(calories, marker='o')
-        plt.savefig('calories.png')
-        plt.close()
-        photo = FSInputFile("./calories.png")
+        user = await store.get(user_id)
+        if command.args:
+            await plot_history(message, user, "calories", command.args, 'Калории по дням')
+            return
+        calories = user['logged_calories']
+        image = await render_chart(user_id, "calories", calories, 'Накопительный учет калорий', 'ккал')
+        photo = BufferedInputFile(image, filename="calories.png")
         await message.reply_photo(photo=photo)
     except KeyError:
         await message.reply("Нет информации, пожалуйста заполните профиль /set_profile и повторите попытку")
 
 
+async def plot_history(message: Message, user: dict, kind: str, period: str, title: str):
+    """Отправка графика по дням за неделю или месяц"""
+    days = PLOT_PERIODS.get(period.strip().lower())
+    if days is None:
+        await message.reply("Укажите период: неделя или месяц. Например: <code>/plot_water </code>неделя",
+                            parse_mode='html')
+        return
+    history = user.get("history")
+    today = local_today(user)
+    if history is None or not history.window(days, today).shape[1]:
+        await message.reply("История пока пуста, она пополняется с каждым /new_day")
+        return
+    image = await render_history(message.from_user.id, kind, history, days, today, title)
+    await message.reply_photo(photo=BufferedInputFile(image, filename=f"{kind}_{days}.png"))
+
+
+@router.message(Command("stats"))
+async def stats(message: Message, store: UserStore):
+    """Статистика по истории: средние, выполненные цели и тренд баланса"""
+    user_id = message.from_user.id
+    try:
+        user = await store.get(user_id)
+    except KeyError:
+        await message.reply("Нет информации, пожалуйста заполните профиль /set_profile и повторите попытку")
+        return
+    history = user.get("history")
+    if history is None or not len(history):
+        await message.reply("История пока пуста, она пополняется с каждым /new_day")
+        return
+    lines = ["Статистика"]
+    for days in (7, 30):
+        summary = history.summary(days, local_today(user))
+        if not summary["days"]:
+            continue
+        lines.append(
+            f"\nЗа {days} дней (записано дней: {summary['days']}):\n"
+            f"- Вода в среднем: {summary['water_avg']:.0f} мл, цель выполнена {summary['water_goal_days']} дн.\n"
+            f"- Калории в среднем: {summary['calories_avg']:.0f} ккал, "
+            f"в пределах цели {summary['calorie_goal_days']} дн.\n"
+            f"- Баланс в среднем: {summary['balance_avg']:.0f} ккал, "
+            f"тренд {summary['balance_trend']:+.1f} ккал в день."
+        )
+    await message.reply("\n".join(lines))
+
+
 @router.message(Command("log_workout"))
-async def log_workout(message: Message, command: CommandObject):
+async def log_workout(message: Message, command: CommandObject, http: ClientSession, store: UserStore,
+                      nutrition: NutritionDB):
     """Функция подсчета калорийности и воды за тренировку"""
     user_id = message.from_user.id
     try:
@@ -186,11 +252,15 @@ async def log_workout(message: Message, command: CommandObject):
         profile_data = ProfileData(time_train=time, train=train_)
         time = profile_data.time_train
         train_ = profile_data.train
-        train = await translate(train_)
-        calories = await get_train_cal(train, time)
+        user = await store.get(user_id)
+        calories = nutrition.exercise_calories(train_, time, user["weight"])
+        if calories is None:
+            train = await translate(train_)
+            calories = await get_train_cal(http, nutrition, train, time, user["weight"])
         workout_water = time // 30 * 200
-        users[user_id]["water_goal"] = users[user_id].get("water_goal", 0) + workout_water
-        users[user_id]["burned_calories"] = users[user_id].get("burned_calories", 0) + calories
+        user["water_goal"] = user.get("water_goal", 0) + workout_water
+        user["burned_calories"] = user.get("burned_calories", 0) + calories
+        await store.save(user_id, user)
         await message.reply(f"{train_} {time} минут — {calories} ккал. Дополнительно: выпейте {workout_water} мл воды.")
     except AttributeError:
         await message.reply(text="Пожалуйста, укажите название тренировки "
@@ -200,30 +270,55 @@ async def log_workout(message: Message, command: CommandObject):
                             "время тренировки от 0 до 1440 минут")
     except KeyError:
         await message.reply("Нет информации, пожалуйста заполните профиль /set_profile и повторите попытку")
+    except NotFound:
+        await message.reply(NOT_FOUND_TRAIN)
+    except UpstreamError:
+        await message.reply(UNAVAILABLE)
 
 
 @router.message(Command("log_food"))
-async def log_food(message: Message, command: CommandObject, state: FSMContext):
-    """Функция подсчета калорийности"""
+async def log_food(message: Message, command: CommandObject, state: FSMContext, http: ClientSession,
+                   store: UserStore, nutrition: NutritionDB):
+    """Функция подсчета калорийности одного продукта или целого приема пищи"""
     food_item_ = command.args
     if not food_item_:
         await message.reply(text="Пожалуйста, укажите название продукта. Например: <code>/log_food </code>банан",
                             parse_mode='html')
         return None
-    food_item = await translate(food_item_)
-
-    calories_for_gramm = await get_food(food_item)
+    # русские названия из локальной базы не требуют перевода
+    foods = nutrition.find_foods(food_item_)
+    try:
+        if foods is None:
+            foods = await get_foods(http, nutrition, await translate(food_item_))
+    except NotFound:
+        await message.reply(NOT_FOUND_FOOD)
+        return None
+    except UpstreamError:
+        await message.reply(UNAVAILABLE)
+        return None
 
-    if isinstance(calories_for_gramm, float):
+    # один продукт без количества уточняется вопросом о граммах, иначе записывается весь прием пищи сразу
+    if len(foods) == 1 and not INLINE_QUANTITY.search(food_item_):
+        calories_for_gramm = round(foods[0]["calories"] / foods[0]["gramms"], 2)
         await state.update_data(calories_for_gramm=calories_for_gramm)
-        await message.reply(f"{food_item_} — {calories_for_gramm*100} ккал на 100 г. Сколько грамм вы съели?")
+        await message.reply(f"{food_item_} — {calories_for_gramm*100:g} ккал на 100 г. Сколько грамм вы съели?")
         await state.set_state(Form.gramms)
-    else:
-        await message.reply(calories_for_gramm)
+        return None
+
+    try:
+        user = await store.get(message.from_user.id)
+    except KeyError:
+        await message.reply("Нет информации, пожалуйста заполните профиль /set_profile и повторите попытку")
+        return None
+    calories = [round(food["calories"], 2) for food in foods]
+    user["logged_calories"].extend(calories)
+    await store.save(message.from_user.id, user)
+    lines = [f"{food['name']} ({food['gramms']:g} г) — {calorie:g} ккал" for food, calorie in zip(foods, calories)]
+    await message.reply("Записано:\n" + "\n".join(lines) + f"\nИтого: {round(sum(calories), 2):g} ккал.")
 
 
 @router.message(Command("log_water"))
-async def log_water(message: Message, command: CommandObject):
+async def log_water(message: Message, command: CommandObject, store: UserStore):
     """Функция подсчета выпитой воды"""
     user_id = message.from_user.id
     water = command.args
@@ -235,9 +330,11 @@ async def log_water(message: Message, command: CommandObject):
         water = int(water)
         profile_data = ProfileData(water=water)
         water = profile_data.water
-        users[user_id]["logged_water"].append(water)
+        user = await store.get(user_id)
+        user["logged_water"].add(water)
+        await store.save(user_id, user)
         await message.reply(f"Записано: {water} мл, осталось выпить за сегодня "
-                            f"{users[user_id]["water_goal"] - sum(users[user_id]["logged_water"])} мл.")
+                            f"{user["water_goal"] - user["logged_water"].total:g} мл.")
     except (ValueError, ValidationError):
         await message.reply("Некорректное значение, введите число мл воды от 0 до 5000")
     except KeyError:
@@ -245,7 +342,7 @@ async def log_water(message: Message, command: CommandObject):
 
 
 @router.message(Form.gramms)
-async def process_log_food(message: Message, state: FSMContext):
+async def process_log_food(message: Message, state: FSMContext, store: UserStore):
     """Функция для записи съеденных грамов и пересчет калорий"""
     user_id = message.from_user.id
     try:
@@ -259,7 +356,9 @@ async def process_log_food(message: Message, state: FSMContext):
     try:
         calories_for_gramm = data.get("calories_for_gramm")
         calories = round(calories_for_gramm*gramms, 2)
-        users[user_id]["logged_calories"].append(calories)
+        user = await store.get(user_id)
+        user["logged_calories"].add(calories)
+        await store.save(user_id, user)
         await message.reply(f"Записано: {calories} ккал.")
         await state.clear()
     except KeyError:
@@ -320,18 +419,12 @@ async def process_city(message: Message, state: FSMContext):
         city = message.text
         profile_data = ProfileData(city=city)
         await state.update_data(city=profile_data.city)
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="Мужской", callback_data="Men")],
-                [InlineKeyboardButton(text="Женский", callback_data="Women")],
-            ]
-        )
-        await message.reply("Какой у вас пол?", reply_markup=keyboard)
+        await message.reply("Какой у вас пол?", reply_markup=SEX_KEYBOARD)
     except (ValueError, ValidationError):
         await message.reply("Некорректное значение, название города должно быть от 3 до 20 букв")
 
 
-async def calculate_tde(callback_query, state: FSMContext):
+async def calculate_tde(callback_query: CallbackQuery, state: FSMContext):
     """Расчет нормы калорий"""
     data = await state.get_data()
     weight = data.get("weight")
@@ -353,59 +446,37 @@ async def calculate_tde(callback_query, state: FSMContext):
     await state.set_state(Form.calorie_goal)
 
 
-@router.callback_query()
-async def handle_callback(callback_query, state: FSMContext):
-    """Функция вобработки нажатий кнопок"""
-    if callback_query.data == "Men":
-        await state.update_data(sex=True)
-        await process_activity(callback_query)
-    elif callback_query.data == "Women":
-        await state.update_data(sex=False)
-        await process_activity(callback_query)
-    elif callback_query.data == "act1":
-        await state.update_data(activity=1.2)
-        await calculate_tde(callback_query, state)
-        await state.set_state(Form.calorie_goal)
-    elif callback_query.data == "act2":
-        await state.update_data(activity=1.375)
-        await calculate_tde(callback_query, state)
-        await state.set_state(Form.calorie_goal)
-    elif callback_query.data == "act3":
-        await state.update_data(activity=1.55)
-        await calculate_tde(callback_query, state)
-        await state.set_state(Form.calorie_goal)
-    elif callback_query.data == "act4":
-        await state.update_data(activity=1.725)
-        await calculate_tde(callback_query, state)
-        await state.set_state(Form.calorie_goal)
-    elif callback_query.data == "act5":
-        await state.update_data(activity=1.9)
-        await calculate_tde(callback_query, state)
-        await state.set_state(Form.calorie_goal)
+@router.callback_query(SexCallback.filter())
+async def choose_sex(callback_query: CallbackQuery, callback_data: SexCallback, state: FSMContext):
+    """Получение пола и запрос активности"""
+    await state.update_data(sex=callback_data.male)
+    await callback_query.message.answer("Какой у вас уровень активности?", reply_markup=ACTIVITY_KEYBOARD)
     await callback_query.message.delete_reply_markup()
+    await callback_query.answer()
 
 
-async def process_activity(callback_query):
-    """Фунция выбора активности"""
-    keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="Сидячая работа, отсутствие упражнений",
-                                      callback_data="act1")],
-                [InlineKeyboardButton(text="Легкие упражнения 1-3 дня в неделю",
-                                      callback_data="act2")],
-                [InlineKeyboardButton(text="Умеренные упражнения 3-5 дней в неделю",
-                                      callback_data="act3")],
-                [InlineKeyboardButton(text="Интенсивные упражнения 6-7 дней в неделю",
-                                      callback_data="act4")],
-                [InlineKeyboardButton(text="Очень интенсивные упражнения, физическая работа",
-                                      callback_data="act5")],
-            ]
-        )
-    await callback_query.message.answer("Какой у вас уровень активности?", reply_markup=keyboard)
+@router.callback_query(ActivityCallback.filter(F.level.in_(ACTIVITY_LEVELS)))
+async def choose_activity(callback_query: CallbackQuery, callback_data: ActivityCallback, state: FSMContext):
+    """Получение активности и расчет нормы калорий"""
+    await state.update_data(activity=ACTIVITY_LEVELS[callback_data.level][1])
+    await calculate_tde(callback_query, state)
+    await callback_query.message.delete_reply_markup()
+    await callback_query.answer()
+
+
+@router.callback_query(F.data.in_(LEGACY_CALLBACKS))
+async def legacy_callback(callback_query: CallbackQuery, state: FSMContext):
+    """Кнопки со старыми данными вида "Men" и "act1" в уже отправленных сообщениях"""
+    callback_data = LEGACY_CALLBACKS[callback_query.data]
+    if isinstance(callback_data, SexCallback):
+        await choose_sex(callback_query, callback_data, state)
+    else:
+        await choose_activity(callback_query, callback_data, state)
 
 
 @router.message(Form.calorie_goal)
-async def process_calorie_goal(message: Message, state: FSMContext):
+async def process_calorie_goal(message: Message, state: FSMContext, store: UserStore,
+                               scheduler: RolloverScheduler | None = None):
     """Получение целевых калорий и вывод инфы"""
     user_id = message.from_user.id
     try:
@@ -424,44 +495,114 @@ async def process_calorie_goal(message: Message, state: FSMContext):
     age = data.get("age")
     sex = data.get("sex")
 
-    users[user_id] = {
+    # при повторном заполнении профиля история, часовой пояс и записи за сегодня сохраняются
+    try:
+        user = await store.get(user_id)
+    except KeyError:
+        user = {}
+    water_goal = age*30 + round(activity*500, 0)
+    today = local_today(user)
+    if user.get("date") != today.isoformat():
+        # незакрытый прошлый день уходит в историю, новый начинается с пустых записей
+        start_day(user, today, water_goal)
+    user.update({
         "weight": weight,
         "height": height,
         "age": age,
         "sex": sex,
         "activity": activity,
         "city": city,
-        "water_goal": age*30 + round(activity*500, 0),
+        "water_goal": water_goal,
         "calorie_goal": calorie_goal,
-        "logged_water": [0],
-        "logged_calories": [0],
-        "burned_calories": 0
-    }
+    })
+    await store.save(user_id, user)
+    if scheduler is not None:
+        await scheduler.schedule(user_id, user)
 
     await message.reply("Спасибо! Ваш профиль успешно создан.")
     await state.clear()
 
 
+@router.message(Command("timezone"))
+async def set_timezone(message: Message, command: CommandObject, store: UserStore,
+                       scheduler: RolloverScheduler | None = None):
+    """Установка часового пояса, по нему день сменяется в полночь"""
+    user_id = message.from_user.id
+    try:
+        user = await store.get(user_id)
+    except KeyError:
+        await message.reply("Нет информации, пожалуйста заполните профиль /set_profile и повторите попытку")
+        return
+    if not command.args:
+        await message.reply(f"Ваш часовой пояс: {user_timezone(user).key}. Изменить: "
+                            "<code>/timezone </code>Asia/Yekaterinburg", parse_mode='html')
+        return
+    try:
+        timezone = ZoneInfo(command.args.strip())
+    except (ValueError, ZoneInfoNotFoundError):
+        await message.reply("Неизвестный часовой пояс, укажите его в виде Europe/Moscow")
+        return
+    user["timezone"] = timezone.key
+    await store.save(user_id, user)
+    if scheduler is not None:
+        await scheduler.schedule(user_id, user)
+    await message.reply(f"Часовой пояс {timezone.key} сохранен, день будет сменяться в полночь по нему.")
+
+
 @router.message(Command("check_progress"))
-async def check_progress(message: Message):
+async def check_progress(message: Message, store: UserStore):
     """Вывод инфы"""
     user_id = message.from_user.id
     try:
-        user_info = users[user_id]
+        user_info = await store.get(user_id)
         await message.reply(
             "Прогресс\n"
             "Вода:\n"
-            f"- Выпито: {sum(user_info['logged_water'])} мл из {user_info['water_goal']} мл.\n"
-            f"- Осталось: {user_info['water_goal'] - sum(user_info['logged_water'])} мл.\n\n"
+            f"- Выпито: {user_info['logged_water'].total:g} мл из {user_info['water_goal']} мл.\n"
+            f"- Осталось: {user_info['water_goal'] - user_info['logged_water'].total:g} мл.\n\n"
             "Калории:\n"
-            f"- Потреблено: {sum(user_info['logged_calories'])} ккал из {user_info['calorie_goal']} ккал.\n"
+            f"- Потреблено: {user_info['logged_calories'].total:g} ккал из {user_info['calorie_goal']} ккал.\n"
             f"- Сожжено: {user_info['burned_calories']} ккал.\n"
-            f"- Баланс: {sum(user_info['logged_calories']) - user_info['burned_calories']} ккал.\n"
+            f"- Баланс: {user_info['logged_calories'].total - user_info['burned_calories']:g} ккал.\n"
         )
     except KeyError:
         await message.reply("Нет информации, пожалуйста заполните профиль /set_profile")
 
 
+@router.message(Command("lag"), F.from_user.id.in_(settings.admin_ids))
+async def loop_lag_report(message: Message, diagnostics: Diagnostics | None = None):
+    """Задержка event loop и последние блокировки, только для администраторов"""
+    if diagnostics is None:
+        await message.reply("Диагностика выключена, включите DIAG_ENABLED=1")
+        return
+    report = diagnostics.report()
+    lines = [f"Задержка loop: сейчас {report['last_lag'] * 1000:.1f} мс, максимум {report['max_lag'] * 1000:.1f} мс",
+             f"Блокировок дольше {report['threshold']} с: {len(report['blocked'])}"]
+    if report["blocked"]:
+        # последний кадр стека - место, где loop стоял
+        last = report["blocked"][-1]
+        frames = last["stack"].strip().splitlines()
+        place = frames[-2].strip() if len(frames) > 1 else "стек недоступен"
+        lines.append(f"Последняя ({last['stalled']} с): {place}")
+    await message.reply("\n".join(lines))
+
+
+@router.message(Command("profile"), F.from_user.id.in_(settings.admin_ids))
+async def loop_profile(message: Message, command: CommandObject, diagnostics: Diagnostics | None = None):
+    """Профиль event loop за N секунд файлом collapsed stacks для flamegraph, только для администраторов"""
+    if diagnostics is None:
+        await message.reply("Диагностика выключена, включите DIAG_ENABLED=1")
+        return
+    try:
+        seconds = float(command.args or 10)
+    except ValueError:
+        await message.reply("Укажите длительность в секундах. Например: /profile 10")
+        return
+    await message.reply(f"Снимаю профиль {min(seconds, diagnostics.max_seconds):g} с...")
+    profile = await diagnostics.profile(seconds)
+    await message.reply_document(BufferedInputFile(profile.encode(), filename="profile.folded"))
+
+
 def setup_handlers(dp):
     """Функция для подключения обработчиков"""
     dp.include_router(router)
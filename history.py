@@ -0,0 +1,91 @@
+import base64
+from datetime import date
+import numpy as np
+
+# Колонки истории: день (порядковый номер даты), выпитая вода, цель по воде, съеденные, цель и сожженные калории
+COLUMNS = ("day", "water", "water_goal", "calories", "calorie_goal", "burned")
+_INDEX = {name: index for index, name in enumerate(COLUMNS)}
+
+
+class History:
+    """Итоги прошлых дней пользователя в колоночном виде, дни идут по возрастанию"""
+    __slots__ = ("data", "size", "changes")
+
+    def __init__(self, capacity: int = 32):
+        self.data = np.zeros((len(COLUMNS), capacity))
+        self.size = 0
+        self.changes = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def version(self) -> int:
+        """Версия данных для кэша графиков, меняется при каждой записи, в том числе при замене дня"""
+        return self.changes
+
+    def column(self, name: str) -> np.ndarray:
+        """Колонка без копирования"""
+        return self.data[_INDEX[name], :self.size]
+
+    def append(self, day: date, water: float, water_goal: float, calories: float, calorie_goal: float,
+               burned: float):
+        """Добавление итогов дня на его место по дате, повторная запись того же дня заменяет прошлую.
+
+        Более ранний день возможен после смены часового пояса на западный: он вставляется
+        по порядку, чтобы window и summary могли искать по колонке day двоичным поиском.
+        """
+        ordinal = day.toordinal()
+        position = int(np.searchsorted(self.column("day"), ordinal))
+        if position == self.size or self.data[0, position] != ordinal:
+            if self.size == self.data.shape[1]:
+                self.data = np.concatenate((self.data, np.zeros_like(self.data)), axis=1)
+            # сдвиг более поздних дней вправо, numpy копирует пересекающиеся срезы корректно
+            self.data[:, position + 1:self.size + 1] = self.data[:, position:self.size]
+            self.size += 1
+        self.data[:, position] = (ordinal, water, water_goal, calories, calorie_goal, burned)
+        self.changes += 1
+
+    def window(self, days: int, today: date) -> np.ndarray:
+        """Срез колонок за последние days дней до today включительно"""
+        start = np.searchsorted(self.column("day"), today.toordinal() - days + 1)
+        return self.data[:, start:self.size]
+
+    def summary(self, days: int, today: date) -> dict:
+        """Средние, дни с выполненными целями и тренд баланса калорий за период"""
+        day, water, water_goal, calories, calorie_goal, burned = self.window(days, today)
+        if not day.size:
+            return {"days": 0}
+        balance = calories - burned
+        # наклон прямой по методу наименьших квадратов, ккал в день
+        trend = float(np.polyfit(day - day[0], balance, 1)[0]) if day.size > 1 else 0.0
+        return {
+            "days": int(day.size),
+            "water_avg": float(water.mean()),
+            "calories_avg": float(calories.mean()),
+            "balance_avg": float(balance.mean()),
+            "water_goal_days": int(np.count_nonzero(water >= water_goal)),
+            "calorie_goal_days": int(np.count_nonzero(calories <= calorie_goal)),
+            "balance_trend": trend,
+        }
+
+    def to_state(self) -> dict:
+        """Компактное представление для хранилища"""
+        return {"h": base64.b64encode(np.ascontiguousarray(self.data[:, :self.size]).tobytes()).decode(),
+                "n": self.changes}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "History":
+        """Восстановление из представления хранилища"""
+        data = np.frombuffer(base64.b64decode(state["h"])).reshape(len(COLUMNS), -1)
+        if np.any(np.diff(data[0]) <= 0):
+            # в истории, записанной до вставки по порядку, дни могли идти вразнобой и повторяться:
+            # сортируем и из повторов оставляем последнюю запись
+            data = data[:, np.argsort(data[0], kind="stable")]
+            data = data[:, np.append(data[0, 1:] != data[0, :-1], True)]
+        history = cls(max(32, data.shape[1] * 2))
+        history.data[:, :data.shape[1]] = data
+        history.size = data.shape[1]
+        # без счетчика в старом формате каждая запись считается одним изменением
+        history.changes = state.get("n", history.size)
+        return history
@@ -0,0 +1,15 @@
+import aiohttp
+from config import settings
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Создание общей сессии с пулом соединений для внешних API"""
+    connector = aiohttp.TCPConnector(
+        limit=settings.http_pool_limit,
+        limit_per_host=settings.http_pool_limit_per_host,
+        keepalive_timeout=settings.http_keepalive,
+        use_dns_cache=True,
+        ttl_dns_cache=settings.http_dns_ttl,
+    )
+    timeout = aiohttp.ClientTimeout(total=settings.http_timeout, connect=settings.http_connect_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
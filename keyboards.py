@@ -0,0 +1,36 @@
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+class SexCallback(CallbackData, prefix="sex"):
+    """Кнопка выбора пола"""
+    male: bool
+
+
+class ActivityCallback(CallbackData, prefix="act"):
+    """Кнопка выбора уровня активности"""
+    level: int
+
+
+# Уровни активности: текст кнопки и коэффициент для нормы калорий
+ACTIVITY_LEVELS = {
+    1: ("Сидячая работа, отсутствие упражнений", 1.2),
+    2: ("Легкие упражнения 1-3 дня в неделю", 1.375),
+    3: ("Умеренные упражнения 3-5 дней в неделю", 1.55),
+    4: ("Интенсивные упражнения 6-7 дней в неделю", 1.725),
+    5: ("Очень интенсивные упражнения, физическая работа", 1.9),
+}
+
+# Клавиатуры не меняются, поэтому собираются один раз при импорте
+SEX_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Мужской", callback_data=SexCallback(male=True).pack())],
+    [InlineKeyboardButton(text="Женский", callback_data=SexCallback(male=False).pack())],
+])
+ACTIVITY_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=text, callback_data=ActivityCallback(level=level).pack())]
+    for level, (text, _) in ACTIVITY_LEVELS.items()
+])
+
+# Данные кнопок из сообщений, отправленных до перехода на CallbackData
+LEGACY_CALLBACKS = {"Men": SexCallback(male=True), "Women": SexCallback(male=False),
+                    **{f"act{level}": ActivityCallback(level=level) for level in ACTIVITY_LEVELS}}
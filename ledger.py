@@ -0,0 +1,80 @@
+import base64
+import time
+from array import array
+from config import settings
+
+
+class DailyLedger:
+    """Записи за день (вода или калории) с временем каждой записи и текущей суммой.
+
+    Сумма обновляется при каждой записи, поэтому прогресс считается за O(1).
+    При превышении max_entries записи сворачиваются в почасовые корзины.
+    """
+    __slots__ = ("amounts", "times", "total", "created", "changes", "max_entries")
+
+    def __init__(self, max_entries: int = settings.ledger_max_entries):
+        self.amounts = array("f")
+        self.times = array("d")
+        self.total = 0.0
+        self.created = time.time()
+        self.changes = 0
+        self.max_entries = max_entries
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    @property
+    def version(self) -> tuple:
+        """Версия данных для кэша графиков"""
+        return self.created, self.changes
+
+    def add(self, amount: float, timestamp: float | None = None):
+        """Добавление записи"""
+        self.amounts.append(amount)
+        self.times.append(time.time() if timestamp is None else timestamp)
+        self.total += amount
+        self.changes += 1
+        if len(self.amounts) > self.max_entries:
+            self.compact()
+
+    def extend(self, amounts, timestamp: float | None = None):
+        """Добавление нескольких записей одним изменением, например всех продуктов одного приема пищи"""
+        timestamp = time.time() if timestamp is None else timestamp
+        for amount in amounts:
+            self.amounts.append(amount)
+            self.times.append(timestamp)
+            self.total += amount
+        self.changes += 1
+        if len(self.amounts) > self.max_entries:
+            self.compact()
+
+    def compact(self):
+        """Свертка записей в почасовые корзины, сумма не меняется"""
+        buckets: dict[float, float] = {}
+        for amount, timestamp in zip(self.amounts, self.times):
+            hour = timestamp - timestamp % 3600
+            buckets[hour] = buckets.get(hour, 0.0) + amount
+        self.times = array("d", buckets)
+        self.amounts = array("f", buckets.values())
+        self.changes += 1
+
+    def to_state(self) -> dict:
+        """Компактное представление для хранилища"""
+        return {"v": base64.b64encode(self.amounts.tobytes()).decode(),
+                "t": base64.b64encode(self.times.tobytes()).decode(),
+                "s": self.total, "c": self.created, "n": self.changes}
+
+    @classmethod
+    def from_state(cls, state) -> "DailyLedger":
+        """Восстановление из представления хранилища, список чисел - старый формат"""
+        ledger = cls()
+        if isinstance(state, list):
+            for amount in state:
+                ledger.add(amount, ledger.created)
+            return ledger
+        ledger.amounts.frombytes(base64.b64decode(state["v"]))
+        ledger.times.frombytes(base64.b64decode(state["t"]))
+        ledger.total = state["s"]
+        ledger.created = state["c"]
+        ledger.changes = state["n"]
+        return ledger
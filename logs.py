@@ -0,0 +1,35 @@
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from config import settings
+
+# Стандартные атрибуты LogRecord, все остальные попадают в лог как поля из extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name,
+                 "msg": record.getMessage()}
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging() -> QueueListener:
+    """Логирование через очередь: обработчики пишут в очередь, вывод идет в отдельном потоке"""
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(settings.log_level)
+    # aiogram пишет строку на каждое обновление, под нагрузкой это заметная доля времени
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    listener.start()
+    return listener
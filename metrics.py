@@ -0,0 +1,164 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Callable
+from aiohttp import web
+from cache import all_caches
+
+# Границы корзин гистограмм задержки в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """Базовая метрика с метками в формате Prometheus"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Counter(Metric):
+    """Счетчик, который только растет"""
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Значение, которое может расти и уменьшаться"""
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, *labels, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            # счетчики по корзинам, затем сумма и количество
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        names = self.labelnames + ("le",)
+        for labels, series in self._series.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+registry: list[Metric] = []
+
+handler_latency = Histogram("bot_handler_duration_seconds", "Время работы обработчика", ("handler",))
+handler_in_flight = Gauge("bot_handlers_in_flight", "Обработчики, выполняющиеся сейчас", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+api_latency = Histogram("bot_api_call_duration_seconds", "Время запроса к внешнему API", ("service",))
+api_calls = Counter("bot_api_calls_total", "Запросы к внешним API по коду ответа", ("service", "status"))
+api_retries = Counter("bot_api_retries_total", "Повторные запросы к внешним API", ("service",))
+circuit_open = Gauge("bot_api_circuit_open", "Автомат внешнего API разомкнут (1) или замкнут (0)", ("service",))
+throttled = Counter("bot_throttled_total", "Отброшенные обновления: превышение лимита или повтор", ("reason",))
+loop_lag = Histogram("bot_loop_lag_seconds", "Задержка пробуждения event loop",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+loop_blocked = Counter("bot_loop_blocked_total", "Эпизоды блокировки event loop дольше порога")
+nutrition_lookups = Counter("bot_nutrition_lookups_total", "Поиск в локальной базе питания", ("kind", "result"))
+startup_seconds = Gauge("bot_startup_seconds", "Время от запуска процесса: imports - после импорта модулей, "
+                        "ready - после инициализации", ("stage",))
+resident_memory = Gauge("bot_startup_resident_memory_bytes", "Резидентная память процесса после инициализации")
+
+
+class ApiCall:
+    """Результат запроса к внешнему API, код ответа заполняет вызывающий код"""
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = "error"
+
+
+@asynccontextmanager
+async def observe_api(service: str):
+    """Замер длительности и кода ответа запроса к внешнему API"""
+    call = ApiCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        api_latency.observe(service, value=time.perf_counter() - start)
+        api_calls.inc(service, str(call.status))
+
+
+def render_caches() -> list[str]:
+    """Статистика всех кэшей процесса"""
+    lines = []
+    for field in ("hits", "misses", "evictions", "coalesced", "stale"):
+        lines.append(f"# TYPE bot_cache_{field}_total counter")
+        lines += [f'bot_cache_{field}_total{{cache="{cache.name}"}} {getattr(cache, field)}' for cache in all_caches]
+    lines.append("# TYPE bot_cache_hit_ratio gauge")
+    for cache in all_caches:
+        total = cache.hits + cache.misses + cache.coalesced + cache.stale
+        ratio = (total - cache.misses) / total if total else 0
+        lines.append(f'bot_cache_hit_ratio{{cache="{cache.name}"}} {ratio:.4f}')
+    return lines
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = [line for metric in registry for line in metric.render()]
+    lines += render_caches()
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_view(_request: web.Request) -> web.Response:
+    """Обработчик GET /metrics"""
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve_metrics(host: str, port: int,
+                        add_routes: Callable[[web.Application], None] | None = None) -> web.AppRunner:
+    """Запуск HTTP-сервера с эндпоинтом /metrics, add_routes добавляет служебные эндпоинты"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    if add_routes is not None:
+        add_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,8 +1,123 @@
+import asyncio
+import logging
+import math
+import random
+import time
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
+from config import settings
+from metrics import handler_latency, handler_in_flight, handler_errors, throttled
+from upstream import TokenBucket
+
+logger = logging.getLogger(__name__)
 
 
 class LoggingMiddleware(BaseMiddleware):  # pylint: disable=R0903
+    """Выборочное логирование входящих сообщений, доля задается LOG_SAMPLE_RATE"""
+
+    def __init__(self, sample_rate: float = settings.log_sample_rate):
+        self.sample_rate = sample_rate
+
     async def __call__(self, handler, event: Message, data: dict):
-        print(f"Получено сообщение: {event.text}")
+        if random.random() < self.sample_rate:
+            logger.info("Получено сообщение", extra={"user_id": event.from_user.id, "text": event.text})
+        return await handler(event, data)
+
+
+class ActivityMiddleware(BaseMiddleware):  # pylint: disable=R0903
+    """Отметка времени последнего обращения пользователя для прогрева погоды по активным пользователям"""
+
+    async def __call__(self, handler, event, data: dict):
+        store = data.get("store")
+        if store is not None and event.from_user is not None:
+            await store.mark_seen(event.from_user.id)
+        return await handler(event, data)
+
+
+class MetricsMiddleware(BaseMiddleware):  # pylint: disable=R0903
+    """Время работы, число выполняющихся и ошибки обработчиков"""
+
+    async def __call__(self, handler, event, data: dict):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        handler_in_flight.inc(name)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(name, value=time.perf_counter() - start)
+            handler_in_flight.dec(name)
+
+
+class ThrottlingMiddleware(BaseMiddleware):  # pylint: disable=R0903
+    """Лимит запросов пользователя, отброс повторов и общий лимит дорогих обработчиков.
+
+    Каждый обработчик списывает свою стоимость из ведра токенов пользователя, при нехватке
+    пользователь один раз получает предупреждение, а обновления отбрасываются до пополнения.
+    Одинаковые сообщения и нажатия одного пользователя в пределах dedup_window отбрасываются.
+    Обработчики дороже 1 (графики, платные API) выполняются не более expensive_limit одновременно.
+    В cluster.py пользователь всегда попадает в один воркер, поэтому состояние процесса достаточно.
+    """
+
+    def __init__(self, rate: float = settings.throttle_rate, burst: float = settings.throttle_burst,
+                 costs: dict[str, float] | None = None, dedup_window: float = settings.throttle_dedup_window,
+                 expensive_limit: int = settings.throttle_expensive_concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.costs = settings.throttle_costs if costs is None else costs
+        self.dedup_window = dedup_window
+        self.expensive = asyncio.Semaphore(expensive_limit)
+        self._buckets: dict[int, TokenBucket] = {}
+        self._warned: set[int] = set()
+        self._recent: dict[tuple, float] = {}
+        self._swept = time.monotonic()
+
+    async def __call__(self, handler, event, data: dict):
+        user = data.get("event_from_user")
+        if user is None or self.rate <= 0:
+            return await handler(event, data)
+        now = time.monotonic()
+        if now - self._swept > 60:
+            self._sweep(now)
+
+        content = event.data if isinstance(event, CallbackQuery) else getattr(event, "text", None)
+        if content is not None:
+            key = (user.id, type(event).__name__, content)
+            seen = self._recent.get(key)
+            self._recent[key] = now
+            if seen is not None and now - seen < self.dedup_window:
+                throttled.inc("duplicate")
+                if isinstance(event, CallbackQuery):
+                    await event.answer()
+                return None
+
+        handler_object = data.get("handler")
+        cost = self.costs.get(handler_object.callback.__name__, 1) if handler_object is not None else 1
+        bucket = self._buckets.get(user.id)
+        if bucket is None:
+            bucket = self._buckets[user.id] = TokenBucket(self.rate, self.burst)
+        wait = bucket.try_acquire(cost)
+        if wait:
+            throttled.inc("rate")
+            if user.id not in self._warned:
+                self._warned.add(user.id)
+                text = f"Слишком много запросов, попробуйте через {math.ceil(wait)} с."
+                await (event.answer(text) if isinstance(event, CallbackQuery) else event.reply(text))
+            return None
+        self._warned.discard(user.id)
+
+        if cost > 1:
+            async with self.expensive:
+                return await handler(event, data)
         return await handler(event, data)
+
+    def _sweep(self, now: float):
+        # полное ведро ничем не отличается от нового, а старые ключи повторов больше не нужны
+        self._swept = now
+        self._recent = {key: seen for key, seen in self._recent.items() if now - seen < self.dedup_window}
+        self._buckets = {user_id: bucket for user_id, bucket in self._buckets.items()
+                         if bucket.refill(now) < bucket.capacity}
+        self._warned &= self._buckets.keys()
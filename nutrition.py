@@ -0,0 +1,200 @@
+import asyncio
+import csv
+import difflib
+import logging
+import re
+import sqlite3
+import threading
+from metrics import nutrition_lookups
+from quantity import UNITS, parse_item, split_items
+
+logger = logging.getLogger(__name__)
+
+FOOD, EXERCISE = "food", "exercise"
+_CYRILLIC = re.compile(r"[а-яё]")
+# Окончания, которые отбрасываются при сравнении слов: падежи и число существительных и прилагательных
+_ENDINGS = re.compile(r"(ами|ями|ого|его|ому|ему|ыми|ими|ием|иям|иях|ой|ей|ий|ый|ая|яя|ое|ее|ую|юю|ые|ие|ых|их|ым|им|"
+                      r"ом|ем|ам|ям|ах|ях|ов|ев|ию|ия|ии|[аяоеыиуюьй]|(?:(?<=[sxo])|(?<=ch)|(?<=sh))es|(?<!s)s)$")
+
+
+def word_stems(name: str) -> list[str]:
+    """Основы слов названия без окончаний, в порядке сортировки"""
+    stems = []
+    for word in re.findall(r"\w+", name.lower()):
+        stem = _ENDINGS.sub("", word)
+        stems.append(stem if len(stem) >= 2 else word)
+    return sorted(stems)
+
+
+class NutritionDB:
+    """Локальная база калорийности продуктов и MET тренировок в SQLite с полнотекстовым индексом.
+
+    Названия ищутся на русском и английском: точное совпадение, затем по префиксам слов
+    через FTS5 с проверкой, что слова совпадают без окончаний, затем нечетким сравнением
+    с опечаткой не больше чем в одну букву по длине. Ответы Nutritionix дописываются в базу:
+    в файл базы - отдельным соединением в потоке, чтобы запись на диск не блокировала event loop.
+    """
+
+    def __init__(self, path: str = ""):
+        self._conn = sqlite3.connect(path or ":memory:")
+        # файл базы может быть общим для воркеров cluster.py
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, kind TEXT, name_ru TEXT, "
+                           "name_en TEXT, value REAL, serving REAL, UNIQUE (kind, name_en))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_ru ON items (kind, name_ru)")
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(name_ru, name_en)")
+            self.fts = True
+        except sqlite3.OperationalError:
+            # сборка SQLite без FTS5: остаются точный и нечеткий поиск
+            self.fts = False
+        self._conn.commit()
+        # названия для нечеткого поиска: вид -> название -> id
+        self._names: dict[str, dict[str, int]] = {FOOD: {}, EXERCISE: {}}
+        for row_id, kind, name_ru, name_en in self._conn.execute("SELECT id, kind, name_ru, name_en FROM items"):
+            self._index_names(row_id, kind, name_ru, name_en)
+        # база в памяти видна только своему соединению и не пишет на диск, ее дополняем напрямую
+        self._writer = sqlite3.connect(path, check_same_thread=False) if path else None
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, dataset: str) -> "NutritionDB":
+        """Открытие базы и загрузка встроенного набора данных, уже известные названия не перезаписываются"""
+        db = cls(path)
+        with open(dataset, encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                db.add(row["kind"], row["name_ru"], row["name_en"], float(row["value"]),
+                       float(row["serving"]) if row["serving"] else None, commit=False)
+        db._conn.commit()
+        logger.info("Локальная база питания: %s продуктов, %s тренировок",
+                    len(db._names[FOOD]), len(db._names[EXERCISE]))
+        return db
+
+    def close(self):
+        """Закрытие соединений"""
+        self._conn.close()
+        if self._writer is not None:
+            with self._write_lock:
+                self._writer.close()
+
+    def _index_names(self, row_id: int, kind: str, name_ru: str, name_en: str):
+        for name in (name_ru, name_en):
+            if name:
+                self._names[kind].setdefault(name, row_id)
+
+    def _insert(self, conn: sqlite3.Connection, kind: str, name_ru: str, name_en: str, value: float,
+                serving: float | None) -> tuple | None:
+        """Вставка записи без commit, (id, вид, названия) новой записи или None, если название уже есть"""
+        name_ru, name_en = name_ru.lower().strip(), name_en.lower().strip()
+        cursor = conn.execute("INSERT OR IGNORE INTO items (kind, name_ru, name_en, value, serving) "
+                              "VALUES (?, ?, ?, ?, ?)", (kind, name_ru, name_en, value, serving))
+        if not cursor.rowcount:
+            return None
+        if self.fts:
+            conn.execute("INSERT INTO items_fts (rowid, name_ru, name_en) VALUES (?, ?, ?)",
+                         (cursor.lastrowid, name_ru, name_en))
+        return cursor.lastrowid, kind, name_ru, name_en
+
+    def add(self, kind: str, name_ru: str, name_en: str, value: float, serving: float | None, commit: bool = True):
+        """Добавление записи: ккал на 100 г и порция в граммах для продукта, MET для тренировки"""
+        added = self._insert(self._conn, kind, name_ru, name_en, value, serving)
+        if added is not None:
+            self._index_names(*added)
+        if commit:
+            self._conn.commit()
+
+    def _write(self, items: list[tuple]) -> list[tuple]:
+        """Запись в файл базы в потоке пула одной транзакцией"""
+        with self._write_lock:
+            added = [self._insert(self._writer, *item) for item in items]
+            self._writer.commit()
+        return [item for item in added if item is not None]
+
+    async def remember(self, items: list[tuple]):
+        """Дописывание записей (вид, name_ru, name_en, значение, порция) из ответов API, ошибка записи не критична"""
+        if not items:
+            return
+        try:
+            if self._writer is None:
+                for item in items:
+                    self.add(*item, commit=False)
+                self._conn.commit()
+                return
+            for added in await asyncio.to_thread(self._write, items):
+                self._index_names(*added)
+        except sqlite3.Error:
+            logger.exception("Не удалось дописать ответ Nutritionix в локальную базу")
+
+    def search(self, kind: str, name: str) -> tuple | None:
+        """Поиск записи (name_ru, name_en, value, serving) по названию на любом из языков"""
+        name = " ".join(name.lower().split())
+        columns = "SELECT items.name_ru, items.name_en, items.value, items.serving FROM items"
+        row = self._conn.execute(f"{columns} WHERE kind = ? AND (name_ru = ? OR name_en = ?)",
+                                 (kind, name, name)).fetchone()
+        if row is None and self.fts:
+            # префиксы слов без окончания, чтобы "яйца" находило "яйцо", "грудку" - "грудка", а "eggs" - "egg"
+            words = re.findall(r"\w+", name)
+            query = " ".join(f'"{word[:-2] if len(word) > 5 else word[:-1] if len(word) > 3 else word}"*'
+                             for word in words)
+            candidates = self._conn.execute(
+                f"{columns} JOIN items_fts ON items_fts.rowid = items.id WHERE items_fts MATCH ? "
+                "AND items.kind = ? ORDER BY bm25(items_fts), length(items.name_en) LIMIT 5",
+                (query, kind)).fetchall() if words else []
+            # префикс находит и другие продукты ("сало" - "салат"), поэтому слова сверяются без окончаний
+            stems = word_stems(name)
+            row = next((candidate for candidate in candidates
+                        if stems in (word_stems(candidate[0]), word_stems(candidate[1]))), None)
+        if row is None:
+            # опечатка, а не другое слово: "малоко" - "молоко", но не "хлебцы" - "хлеб"
+            close = [match for match in difflib.get_close_matches(name, self._names[kind], n=3, cutoff=0.8)
+                     if abs(len(match) - len(name)) <= 1]
+            if close:
+                row = self._conn.execute(f"{columns} WHERE id = ?", (self._names[kind][close[0]],)).fetchone()
+        nutrition_lookups.inc(kind, "miss" if row is None else "hit")
+        return row
+
+    def find_foods(self, query: str) -> list[dict] | None:
+        """Разбор приема пищи по локальной базе, None - если хотя бы одного продукта нет"""
+        foods = []
+        for item in split_items(query.lower()):
+            amount, unit, name = parse_item(item)
+            row = self.search(FOOD, name)
+            if row is None:
+                return None
+            name_ru, name_en, value, serving = row
+            if amount is None:
+                gramms = serving
+            elif unit is not None and UNITS[unit][1] is not None:
+                gramms = amount * UNITS[unit][1]
+            elif unit is None and amount > 10:
+                # "рис 150" - это граммы, а не 150 порций
+                gramms = amount
+            else:
+                gramms = amount * serving
+            foods.append({"name": name_ru if _CYRILLIC.search(name) and name_ru else name_en,
+                          "calories": round(value * gramms / 100, 2), "gramms": round(gramms, 1)})
+        return foods or None
+
+    async def remember_foods(self, foods: list[dict]):
+        """Запись ответа Nutritionix по продуктам в локальную базу"""
+        items = []
+        for food in foods:
+            gramms = food["serving_weight_grams"]
+            if not gramms:
+                continue
+            # порция на одну штуку, если количество было указано не в граммах
+            serving = 100 if food["serving_unit"] in ("g", "grams") else gramms / (food["serving_qty"] or 1)
+            items.append((FOOD, "", food["food_name"], food["nf_calories"] / gramms * 100, serving))
+        await self.remember(items)
+
+    def exercise_calories(self, name: str, minutes: int, weight: float) -> float | None:
+        """Расход калорий на тренировку по MET: MET * вес * часы"""
+        row = self.search(EXERCISE, name)
+        if row is None:
+            return None
+        return round(row[2] * weight * minutes / 60, 1)
+
+    async def remember_exercise(self, exercise: dict):
+        """Запись MET тренировки из ответа Nutritionix в локальную базу"""
+        if exercise.get("met"):
+            await self.remember([(EXERCISE, "", exercise["name"], exercise["met"], None)])
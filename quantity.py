@@ -0,0 +1,32 @@
+import re
+
+# Единицы количества: английское написание для перевода запроса и множитель в граммы (миллилитры считаются
+# граммами), у штук оба значения None - количество означает порции
+UNITS = {"г": ("g", 1), "гр": ("g", 1), "грамм": ("g", 1), "граммов": ("g", 1), "g": ("g", 1), "gr": ("g", 1),
+         "gram": ("g", 1), "grams": ("g", 1), "кг": ("kg", 1000), "kg": ("kg", 1000), "мл": ("ml", 1),
+         "ml": ("ml", 1), "л": ("l", 1000), "l": ("l", 1000), "шт": (None, None), "pcs": (None, None)}
+_UNIT = r"(?:(" + "|".join(sorted(UNITS, key=len, reverse=True)) + r")\b\.?)?"
+# Количество перед названием продукта, например "100 г риса"
+_QUANTITY = re.compile(r"^(\d+(?:[.,]\d+)?)\s*" + _UNIT + r"\s*(.+)$")
+# то же количество после названия: "рис 100г"
+_QUANTITY_AFTER = re.compile(r"^(.+?)\s+(\d+(?:[.,]\d+)?)\s*" + _UNIT + r"$")
+# Разделители позиций в запросе из нескольких продуктов, запятая между цифрами - десятичная: "1,5 кг"
+_ITEMS = re.compile(r"\s*(?:[;+]|(?<!\d),|,(?!\d))\s*|\s+(?:и|and)\s+")
+
+
+def split_items(query: str) -> list[str]:
+    """Позиции запроса из нескольких продуктов, запрос должен быть в нижнем регистре"""
+    return [item for item in _ITEMS.split(" ".join(query.split())) if item]
+
+
+def parse_item(text: str) -> tuple[float | None, str | None, str]:
+    """Разбор позиции на количество, единицу и название"""
+    match = _QUANTITY.match(text)
+    if match:
+        amount, unit, name = match.groups()
+        return float(amount.replace(",", ".")), unit, name
+    match = _QUANTITY_AFTER.match(text)
+    if match:
+        name, amount, unit = match.groups()
+        return float(amount.replace(",", ".")), unit, name
+    return None, None, text
@@ -0,0 +1,124 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, time as dtime
+from typing import Callable
+from aiohttp import ClientSession
+from config import settings
+from daily import base_water_goal, compute_water_goal, local_today, start_day, user_timezone
+from storage import UserStore
+
+logger = logging.getLogger(__name__)
+
+PREPARE, ROLLOVER = 0, 1
+# Как часто ближайшие смены дня подгружаются из индекса хранилища, секунды
+LOAD_INTERVAL = 600
+
+
+def next_midnight(user: dict, now: float) -> float:
+    """Время ближайшей полуночи в часовом поясе пользователя"""
+    timezone = user_timezone(user)
+    tomorrow = (datetime.fromtimestamp(now, timezone) + timedelta(days=1)).date()
+    return datetime.combine(tomorrow, dtime(0), timezone).timestamp()
+
+
+class RolloverScheduler:
+    """Смена дня пользователей в их локальную полночь.
+
+    Время следующей смены дня каждого пользователя хранится в индексе хранилища, в память раз в
+    LOAD_INTERVAL секунд подгружаются только ближайшие, без перебора всех профилей. События лежат
+    в куче по времени, за проход обрабатываются только наступившие. За ROLLOVER_PREPARE_AHEAD секунд
+    до полуночи норма воды на следующий день считается заранее, вместе с запросом погоды.
+    """
+
+    def __init__(self, store: UserStore, client: ClientSession, owns: Callable[[int], bool] = lambda user_id: True):
+        self.store = store
+        self.client = client
+        self.owns = owns
+        self._heap: list[tuple[float, int, int]] = []
+        self._planned: dict[int, tuple[float, float]] = {}
+        self._wakeup = asyncio.Event()
+        self._next_load = 0.0
+
+    async def load(self, until: float):
+        """Планирование пользователей со сменой дня до until из индекса, пропущенная смена дня выполняется сразу"""
+        now = time.time()
+        for user_id, midnight in await self.store.due_rollovers(until):
+            if not self.owns(user_id) or self._planned.get(user_id, (None, None))[ROLLOVER] == midnight:
+                continue
+            if midnight > now:
+                self._plan(user_id, midnight)
+                continue
+            try:
+                user = await self.store.get(user_id)
+            except KeyError:
+                continue
+            today = local_today(user)
+            if user.get("date", today.isoformat()) < today.isoformat():
+                start_day(user, today, base_water_goal(user))
+                await self.store.save(user_id, user)
+            await self.schedule(user_id, user)
+
+    async def schedule(self, user_id: int, user: dict):
+        """Планирование следующей смены дня, прошлое расписание пользователя отменяется"""
+        midnight = next_midnight(user, time.time())
+        self._plan(user_id, midnight)
+        await self.store.set_rollover(user_id, midnight)
+
+    def _plan(self, user_id: int, midnight: float):
+        now = time.time()
+        prepare = max(now, midnight - settings.rollover_prepare_ahead)
+        self._planned[user_id] = (prepare, midnight)
+        heapq.heappush(self._heap, (prepare, PREPARE, user_id))
+        heapq.heappush(self._heap, (midnight, ROLLOVER, user_id))
+        if self._heap[0][2] == user_id:
+            self._wakeup.set()
+
+    async def run(self):
+        """Подгрузка ближайших смен дня из индекса и обработка наступивших событий пачками до ROLLOVER_BATCH_SIZE"""
+        while True:
+            if time.time() >= self._next_load:
+                self._next_load = time.time() + LOAD_INTERVAL
+                try:
+                    await self.load(self._next_load + settings.rollover_prepare_ahead + LOAD_INTERVAL)
+                except Exception:  # pylint: disable=W0718
+                    logger.exception("Не удалось загрузить ближайшие смены дня")
+            wake = min(self._heap[0][0], self._next_load) if self._heap else self._next_load
+            delay = wake - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+            batch = []
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now and len(batch) < settings.rollover_batch_size:
+                batch.append(heapq.heappop(self._heap))
+            results = await asyncio.gather(*(self._process(*event) for event in batch), return_exceptions=True)
+            for event, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.error("Не удалось сменить день пользователю %s: %r", event[2], result)
+
+    async def _process(self, due: float, kind: int, user_id: int):
+        # событие из отмененного расписания, например после смены часового пояса
+        if self._planned.get(user_id, (None, None))[kind] != due:
+            return
+        midnight = self._planned[user_id][ROLLOVER]
+        user = await self.store.get(user_id)
+        if kind == PREPARE:
+            water_goal = await compute_water_goal(self.client, user)
+            # пока шел запрос погоды, пользователь мог что-то записать: сохраняем свежую копию
+            user = await self.store.get(user_id)
+            user["next_water_goal"] = water_goal
+        else:
+            day = datetime.fromtimestamp(midnight, user_timezone(user)).date()
+            await self.schedule(user_id, user)
+            # день уже сменила другая реплика с общим хранилищем или повторное событие
+            if user.get("date", "") >= day.isoformat():
+                return
+            water_goal = user.pop("next_water_goal", None)
+            start_day(user, day, water_goal if water_goal is not None else base_water_goal(user))
+        await self.store.save(user_id, user)
@@ -0,0 +1,326 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date
+import aiosqlite
+from history import History
+from ledger import DailyLedger
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Поля пользователя, которые относятся к текущему дню, остальные - профиль
+DAY_FIELDS = ("date", "water_goal", "logged_water", "logged_calories", "burned_calories")
+# История прошлых дней меняется раз в день, SQLite хранит ее отдельно от профиля
+HISTORY_FIELD = "history"
+LEDGER_FIELDS = ("logged_water", "logged_calories")
+
+
+def dumps(data: dict) -> str:
+    """Сериализация данных пользователя, дневные записи и история сохраняются в компактном виде"""
+    return json.dumps(data, separators=(",", ":"), default=lambda obj: obj.to_state())
+
+
+def loads(raw: str) -> dict:
+    """Восстановление данных пользователя"""
+    data = json.loads(raw)
+    for field in LEDGER_FIELDS:
+        if field in data:
+            data[field] = DailyLedger.from_state(data[field])
+    if "history" in data:
+        data["history"] = History.from_state(data["history"])
+    return data
+
+
+class UserStore(ABC):
+    """Хранилище профилей и дневных записей пользователей"""
+
+    async def start(self):
+        """Подготовка хранилища к работе"""
+
+    async def close(self):
+        """Сохранение несохраненных данных и закрытие хранилища"""
+
+    @abstractmethod
+    async def get(self, user_id: int) -> dict:
+        """Данные пользователя, KeyError если профиля нет"""
+
+    @abstractmethod
+    async def save(self, user_id: int, user: dict):
+        """Сохранение данных пользователя"""
+
+    @abstractmethod
+    async def user_ids(self) -> list[int]:
+        """Идентификаторы всех пользователей"""
+
+    @abstractmethod
+    async def mark_seen(self, user_id: int):
+        """Отметка, что пользователь только что обращался к боту"""
+
+    @abstractmethod
+    async def active_user_ids(self, since: float) -> list[int]:
+        """Пользователи, обращавшиеся к боту не раньше since (время unix), без загрузки профилей"""
+
+    @abstractmethod
+    async def set_rollover(self, user_id: int, at: float):
+        """Время следующей смены дня пользователя (время unix)"""
+
+    @abstractmethod
+    async def due_rollovers(self, until: float) -> list[tuple[int, float]]:
+        """Пользователи со сменой дня не позже until и ее время, без загрузки профилей"""
+
+
+class MemoryUserStore(UserStore):
+    """Хранилище в памяти процесса, данные теряются при перезапуске"""
+
+    def __init__(self):
+        self._users: dict[int, dict] = {}
+        self._seen: dict[int, float] = {}
+        self._rollovers: dict[int, float] = {}
+
+    async def get(self, user_id: int) -> dict:
+        return self._users[user_id]
+
+    async def save(self, user_id: int, user: dict):
+        self._users[user_id] = user
+
+    async def user_ids(self) -> list[int]:
+        return list(self._users)
+
+    async def mark_seen(self, user_id: int):
+        self._seen[user_id] = time.time()
+
+    async def active_user_ids(self, since: float) -> list[int]:
+        return [user_id for user_id, seen in self._seen.items() if seen >= since]
+
+    async def set_rollover(self, user_id: int, at: float):
+        self._rollovers[user_id] = at
+
+    async def due_rollovers(self, until: float) -> list[tuple[int, float]]:
+        return [(user_id, at) for user_id, at in self._rollovers.items() if at <= until]
+
+
+class SQLiteUserStore(UserStore):
+    """Хранилище в SQLite с отложенной пакетной записью изменений.
+
+    Пользователи кэшируются в памяти: после каждой записи на диск из кэша вытесняются сохраненные
+    записи, к которым не обращались cache_idle секунд, и самые старые сверх cache_size.
+    История лежит в отдельной таблице и перезаписывается, только когда меняется ее версия,
+    то есть при архивировании дня, а не при каждой записи воды или еды.
+    """
+
+    def __init__(self, path: str, flush_interval: float, cache_size: int = 10000, cache_idle: float = 300):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.cache_idle = cache_idle
+        self._db: aiosqlite.Connection | None = None
+        # пользователь -> (время последнего обращения, данные), от давних обращений к недавним
+        self._cache: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self._dirty: set[int] = set()
+        # время последнего обращения, пишется на диск вместе с изменениями
+        self._seen: dict[int, float] = {}
+        # время следующей смены дня, пишется на диск вместе с изменениями
+        self._rollovers: dict[int, float] = {}
+        # версия истории, которая сейчас лежит в базе, для пользователей в кэше
+        self._history_versions: dict[int, int] = {}
+        self._stop = asyncio.Event()
+        self._flusher: asyncio.Task | None = None
+
+    async def start(self):
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "CREATE TABLE IF NOT EXISTS profiles (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS daily_logs (user_id INTEGER NOT NULL, date TEXT NOT NULL, "
+            "data TEXT NOT NULL, PRIMARY KEY (user_id, date));"
+            "CREATE INDEX IF NOT EXISTS ix_daily_logs_date ON daily_logs (date);"
+            "CREATE TABLE IF NOT EXISTS histories (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS last_seen (user_id INTEGER PRIMARY KEY, seen REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS ix_last_seen_seen ON last_seen (seen);"
+            "CREATE TABLE IF NOT EXISTS rollovers (user_id INTEGER PRIMARY KEY, at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS ix_rollovers_at ON rollovers (at);"
+            # профили без расписания, например из базы до появления индекса, планируются при первой загрузке
+            "INSERT OR IGNORE INTO rollovers SELECT user_id, 0 FROM profiles;"
+        )
+        await self._db.commit()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        # цикл дописывает текущую пачку и выходит, отмена посреди записи потеряла бы ее
+        self._stop.set()
+        if self._flusher is not None:
+            await self._flusher
+        await self.flush()
+        await self._db.close()
+
+    def _remember(self, user_id: int, user: dict):
+        self._cache[user_id] = (time.monotonic(), user)
+        self._cache.move_to_end(user_id)
+
+    def _evict(self):
+        """Вытеснение сохраненных записей: давно не использованных и лишних сверх cache_size"""
+        expired = time.monotonic() - self.cache_idle
+        for user_id, (touched, _) in list(self._cache.items()):
+            if len(self._cache) <= self.cache_size and touched > expired:
+                break
+            if user_id not in self._dirty:
+                del self._cache[user_id]
+                self._history_versions.pop(user_id, None)
+
+    async def get(self, user_id: int) -> dict:
+        if user_id in self._cache:
+            user = self._cache[user_id][1]
+            self._remember(user_id, user)
+            return user
+        async with self._db.execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            raise KeyError(user_id)
+        user = loads(row[0])
+        async with self._db.execute("SELECT data FROM daily_logs WHERE user_id = ? ORDER BY date DESC LIMIT 1",
+                                    (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is not None:
+            user.update(loads(row[0]))
+        async with self._db.execute("SELECT data FROM histories WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is not None:
+            user[HISTORY_FIELD] = History.from_state(json.loads(row[0]))
+            self._history_versions[user_id] = user[HISTORY_FIELD].version
+        self._remember(user_id, user)
+        return user
+
+    async def save(self, user_id: int, user: dict):
+        self._remember(user_id, user)
+        self._dirty.add(user_id)
+
+    async def user_ids(self) -> list[int]:
+        await self.flush()
+        async with self._db.execute("SELECT user_id FROM profiles") as cursor:
+            return [row[0] async for row in cursor]
+
+    async def mark_seen(self, user_id: int):
+        self._seen[user_id] = time.time()
+
+    async def active_user_ids(self, since: float) -> list[int]:
+        await self.flush()
+        async with self._db.execute("SELECT user_id FROM last_seen WHERE seen >= ?", (since,)) as cursor:
+            return [row[0] async for row in cursor]
+
+    async def set_rollover(self, user_id: int, at: float):
+        self._rollovers[user_id] = at
+
+    async def due_rollovers(self, until: float) -> list[tuple[int, float]]:
+        await self.flush()
+        async with self._db.execute("SELECT user_id, at FROM rollovers WHERE at <= ?", (until,)) as cursor:
+            return [tuple(row) async for row in cursor]
+
+    async def flush(self):
+        """Запись накопленных изменений одной транзакцией"""
+        if not self._dirty and not self._seen and not self._rollovers:
+            self._evict()
+            return
+        dirty, self._dirty = self._dirty, set()
+        seen, self._seen = self._seen, {}
+        rollovers, self._rollovers = self._rollovers, {}
+        profiles, days, histories = [], [], []
+        for user_id in dirty:
+            user = self._cache[user_id][1]
+            profile = {key: value for key, value in user.items() if key not in DAY_FIELDS and key != HISTORY_FIELD}
+            day = {key: user[key] for key in DAY_FIELDS if key in user}
+            profiles.append((user_id, dumps(profile)))
+            days.append((user_id, day.get("date", date.today().isoformat()), dumps(day)))
+            history = user.get(HISTORY_FIELD)
+            if history is not None and self._history_versions.get(user_id) != history.version:
+                histories.append((user_id, history.version, dumps(history)))
+        try:
+            await self._db.executemany("INSERT OR REPLACE INTO profiles VALUES (?, ?)", profiles)
+            await self._db.executemany("INSERT OR REPLACE INTO daily_logs VALUES (?, ?, ?)", days)
+            await self._db.executemany("INSERT OR REPLACE INTO histories VALUES (?, ?)",
+                                       [(user_id, data) for user_id, _, data in histories])
+            await self._db.executemany("INSERT OR REPLACE INTO last_seen VALUES (?, ?)", seen.items())
+            await self._db.executemany("INSERT OR REPLACE INTO rollovers VALUES (?, ?)", rollovers.items())
+            await self._db.commit()
+        except BaseException:
+            # не теряем изменения ни при ошибке, ни при отмене, они запишутся следующей попыткой
+            self._dirty |= dirty
+            self._seen = seen | self._seen
+            self._rollovers = rollovers | self._rollovers
+            raise
+        for user_id, version, _ in histories:
+            self._history_versions[user_id] = version
+        self._evict()
+
+    async def _flush_loop(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:  # pylint: disable=W0718
+                logger.exception("Не удалось сохранить пользователей")
+
+
+class RedisUserStore(UserStore):
+    """Хранилище в Redis, общее для нескольких реплик бота"""
+
+    def __init__(self, client, prefix: str = "user:"):
+        self.client = client
+        self.prefix = prefix
+        # отсортированное множество пользователь -> время обращения, ключ вне prefix, чтобы не попасть в user_ids
+        self.seen_key = f"{prefix.rstrip(':')}_seen"
+        # отсортированное множество пользователь -> время следующей смены дня
+        self.rollover_key = f"{prefix.rstrip(':')}_rollover"
+
+    async def start(self):
+        # профили из базы до появления индекса один раз планируются при первой загрузке
+        if not await self.client.exists(self.rollover_key):
+            user_ids = await self.user_ids()
+            if user_ids:
+                await self.client.zadd(self.rollover_key, {str(user_id): 0 for user_id in user_ids}, nx=True)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def get(self, user_id: int) -> dict:
+        data = await self.client.get(f"{self.prefix}{user_id}")
+        if data is None:
+            raise KeyError(user_id)
+        return loads(data)
+
+    async def save(self, user_id: int, user: dict):
+        await self.client.set(f"{self.prefix}{user_id}", dumps(user))
+
+    async def user_ids(self) -> list[int]:
+        return [int(key[len(self.prefix):]) async for key in self.client.scan_iter(match=f"{self.prefix}*")]
+
+    async def mark_seen(self, user_id: int):
+        await self.client.zadd(self.seen_key, {str(user_id): time.time()})
+
+    async def active_user_ids(self, since: float) -> list[int]:
+        return [int(user_id) for user_id in await self.client.zrangebyscore(self.seen_key, since, "+inf")]
+
+    async def set_rollover(self, user_id: int, at: float):
+        await self.client.zadd(self.rollover_key, {str(user_id): at})
+
+    async def due_rollovers(self, until: float) -> list[tuple[int, float]]:
+        due = await self.client.zrangebyscore(self.rollover_key, "-inf", until, withscores=True)
+        return [(int(user_id), at) for user_id, at in due]
+
+
+def create_user_store() -> UserStore:
+    """Создание хранилища по переменной окружения STORAGE_BACKEND"""
+    if settings.storage_backend == "sqlite":
+        return SQLiteUserStore(settings.storage_path, settings.storage_flush_interval, settings.storage_cache_size,
+                               settings.storage_cache_idle)
+    if settings.storage_backend == "redis":
+        # redis нужен только для этого варианта, поэтому импортируется здесь
+        from redis.asyncio import Redis  # pylint: disable=C0415
+        return RedisUserStore(Redis.from_url(settings.redis_url, decode_responses=True))
+    return MemoryUserStore()
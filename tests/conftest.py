@@ -0,0 +1,6 @@
+import os
+import sys
+
+# config.py требует токен бота при импорте, модули бота лежат в корне репозитория
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
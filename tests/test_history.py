@@ -0,0 +1,30 @@
+from datetime import date
+import numpy as np
+from history import History
+
+
+def test_append_keeps_days_sorted():
+    """Более ранний день после смены часового пояса встает на свое место, повтор дня заменяет его"""
+    history = History(capacity=2)
+    for day in (10, 12, 14):
+        history.append(date(2026, 10, day), day, 2000, 1800, 2100, 0)
+    history.append(date(2026, 10, 11), 11, 2000, 1800, 2100, 0)
+    history.append(date(2026, 10, 12), 120, 2000, 1800, 2100, 0)
+    history.append(date(2026, 10, 9), 9, 2000, 1800, 2100, 0)
+    assert list(history.column("water")) == [9, 10, 11, 120, 14]
+    assert np.all(np.diff(history.column("day")) > 0)
+    assert history.version == 6
+    assert list(history.window(3, date(2026, 10, 14))[1]) == [120, 14]
+    assert history.summary(5, date(2026, 10, 14))["days"] == 4
+
+
+def test_from_state_repairs_unsorted_days():
+    """Старая история с днями вразнобой и повтором дня восстанавливается отсортированной"""
+    history = History()
+    # порядок, который мог оставить прежний append: 11 октября после 12-го и 12-е еще раз
+    days = [date(2026, 10, day).toordinal() for day in (10, 12, 11, 12)]
+    history.data[:2, :4] = (days, [1, 2, 3, 4])
+    history.size = 4
+    restored = History.from_state(history.to_state())
+    assert list(restored.column("water")) == [1, 3, 4]
+    assert len(restored) == 3
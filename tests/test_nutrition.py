@@ -0,0 +1,34 @@
+import os
+import pytest
+from nutrition import EXERCISE, FOOD, NutritionDB
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nutrition.csv")
+
+
+@pytest.fixture(scope="module")
+def db():
+    database = NutritionDB.load("", DATASET)
+    yield database
+    database.close()
+
+
+@pytest.mark.parametrize("query", ["сало", "морс", "хлебцы"])
+def test_search_rejects_other_foods(db, query):
+    """Префикс или близкое написание другого продукта - промах, а не 'салат', 'морковь' или 'хлеб'"""
+    assert db.search(FOOD, query) is None
+
+
+@pytest.mark.parametrize("query, name", [("малоко", "молоко"), ("гречки", "гречка"), ("яйца", "яйцо"),
+                                         ("eggs", "egg")])
+def test_search_accepts_typos_and_inflections(db, query, name):
+    """Опечатка в одну букву и другая форма слова находят продукт"""
+    row = db.search(FOOD, query)
+    assert row is not None and name in row[:2]
+
+
+def test_find_foods_parses_quantities(db):
+    """Количество до и после названия, граммы и порции"""
+    foods = db.find_foods("100 г риса, гречка 1,5 кг")
+    assert [food["gramms"] for food in foods] == [100, 1500]
+    assert db.find_foods("рис и сало") is None
+    assert db.search(EXERCISE, "бег") is not None
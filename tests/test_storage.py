@@ -0,0 +1,128 @@
+import asyncio
+import time
+from datetime import date
+import fakeredis
+import numpy as np
+import pytest
+from history import History, COLUMNS
+from ledger import DailyLedger
+from storage import MemoryUserStore, RedisUserStore, SQLiteUserStore
+
+
+def make_user() -> dict:
+    """Профиль с дневными записями и историей прошлых дней"""
+    water, calories = DailyLedger(), DailyLedger()
+    water.add(250, 1_700_000_000)
+    water.extend([300, 150], 1_700_003_600)
+    calories.add(512.5, 1_700_000_100)
+    history = History(capacity=2)
+    for offset in range(5):
+        history.append(date(2026, 10, 10 + offset), 1500 + offset, 2000, 1800, 2100, 300 + offset)
+    return {"weight": 70, "height": 175, "age": 30, "city": "Москва", "date": "2026-10-15", "water_goal": 2100,
+            "logged_water": water, "logged_calories": calories, "burned_calories": 320, "history": history}
+
+
+async def open_memory(_tmp_path):
+    store = MemoryUserStore()
+
+    async def reopen():
+        return store
+
+    return store, reopen
+
+
+async def open_sqlite(tmp_path):
+    path = str(tmp_path / "users.db")
+    store = SQLiteUserStore(path, flush_interval=60)
+    await store.start()
+
+    async def reopen():
+        # новый экземпляр читает с диска, а не из кэша первого
+        await store.close()
+        reopened = SQLiteUserStore(path, flush_interval=60)
+        await reopened.start()
+        return reopened
+
+    return store, reopen
+
+
+async def open_redis(_tmp_path):
+    server = fakeredis.FakeServer()
+    store = RedisUserStore(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+
+    async def reopen():
+        return RedisUserStore(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+
+    return store, reopen
+
+
+@pytest.mark.parametrize("open_store", [open_memory, open_sqlite, open_redis], ids=["memory", "sqlite", "redis"])
+def test_roundtrip(open_store, tmp_path):
+    """Профиль, дневные записи и история переживают сохранение и повторное открытие хранилища"""
+
+    async def scenario():
+        store, reopen = await open_store(tmp_path)
+        user = make_user()
+        await store.save(1, user)
+        store = await reopen()
+        loaded = await store.get(1)
+        assert await store.user_ids() == [1]
+        for field in ("weight", "city", "date", "water_goal", "burned_calories"):
+            assert loaded[field] == user[field]
+        for field in ("logged_water", "logged_calories"):
+            assert list(loaded[field].amounts) == list(user[field].amounts)
+            assert list(loaded[field].times) == list(user[field].times)
+            assert loaded[field].total == user[field].total
+            assert loaded[field].version == user[field].version
+        assert len(loaded["history"]) == 5
+        assert loaded["history"].version == user["history"].version
+        for name in COLUMNS:
+            assert np.array_equal(loaded["history"].column(name), user["history"].column(name))
+        # восстановленная история продолжает расти, а повторная запись дня меняет версию
+        loaded["history"].append(date(2026, 10, 15), 1, 2, 3, 4, 5)
+        assert len(loaded["history"]) == 6
+        version = loaded["history"].version
+        loaded["history"].append(date(2026, 10, 15), 10, 2, 3, 4, 5)
+        assert len(loaded["history"]) == 6 and loaded["history"].version != version
+        with pytest.raises(KeyError):
+            await store.get(2)
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("open_store", [open_memory, open_sqlite, open_redis], ids=["memory", "sqlite", "redis"])
+def test_active_user_ids(open_store, tmp_path):
+    """Активными считаются только пользователи, обращавшиеся к боту, а не все сохраненные"""
+
+    async def scenario():
+        store, reopen = await open_store(tmp_path)
+        await store.save(1, make_user())
+        await store.save(2, make_user())
+        started = time.time()
+        await store.mark_seen(2)
+        store = await reopen()
+        assert await store.active_user_ids(started - 1) == [2]
+        assert await store.active_user_ids(time.time() + 1) == []
+        assert sorted(await store.user_ids()) == [1, 2]
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("open_store", [open_memory, open_sqlite, open_redis], ids=["memory", "sqlite", "redis"])
+def test_due_rollovers(open_store, tmp_path):
+    """Индекс смен дня отдает только пользователей со сменой до заданного времени, последнее время побеждает"""
+
+    async def scenario():
+        store, reopen = await open_store(tmp_path)
+        await store.set_rollover(1, 5_000)
+        await store.set_rollover(2, 100)
+        await store.set_rollover(1, 50)
+        await store.set_rollover(3, 10_000)
+        store = await reopen()
+        assert sorted(await store.due_rollovers(1_000)) == [(1, 50), (2, 100)]
+        assert await store.due_rollovers(10) == []
+        await store.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,78 @@
+import asyncio
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from upstream import CircuitOpen, RateLimited, Upstream, UpstreamUnavailable
+
+
+async def parse(response: aiohttp.ClientResponse) -> dict:
+    return await response.json()
+
+
+def make_upstream(**kwargs) -> Upstream:
+    options = {"rate": 0, "burst": 1, "deadline": 5, "retries": 2, "backoff": 0, "failures": 3, "reset_timeout": 30}
+    options.update(kwargs)
+    return Upstream("test", **options)
+
+
+def run_with_server(statuses: list[int], scenario):
+    """Запуск сценария против локального API, который отвечает статусами из statuses по очереди, затем 200"""
+    calls = []
+
+    async def handle(_request: web.Request) -> web.Response:
+        status = statuses[len(calls)] if len(calls) < len(statuses) else 200
+        calls.append(status)
+        return web.json_response({"ok": status == 200}, status=status)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/", handle)
+        async with TestServer(app) as server, aiohttp.ClientSession() as client:
+            await scenario(client, str(server.make_url("/")), calls)
+
+    asyncio.run(main())
+
+
+def test_retries_on_503_and_429():
+    """5xx и 429 повторяются, успешный повтор не считается ошибкой автомата"""
+    upstream = make_upstream()
+
+    async def scenario(client, url, calls):
+        assert await upstream.request(client, "GET", url, parse) == {"ok": True}
+        assert calls == [503, 429, 200]
+        assert upstream.breaker.failures == 0
+
+    run_with_server([503, 429], scenario)
+
+
+def test_rate_limited_is_not_a_breaker_failure():
+    """Запрос, которому не хватило своего лимита до дедлайна, отклоняется без учета в автомате"""
+    upstream = make_upstream(rate=0.01, burst=1, deadline=0.5, failures=1)
+
+    async def scenario(client, url, calls):
+        await upstream.request(client, "GET", url, parse)
+        with pytest.raises(RateLimited):
+            await upstream.request(client, "GET", url, parse)
+        assert calls == [200]
+        assert upstream.breaker.failures == 0 and upstream.breaker.allow()
+
+    run_with_server([], scenario)
+
+
+def test_breaker_opens_after_threshold_and_closes_after_probe():
+    """После failures неудач подряд запросы не отправляются, успешная проба замыкает автомат"""
+    upstream = make_upstream(retries=0, failures=2, reset_timeout=0.2)
+
+    async def scenario(client, url, calls):
+        for _ in range(2):
+            with pytest.raises(UpstreamUnavailable):
+                await upstream.request(client, "GET", url, parse)
+        with pytest.raises(CircuitOpen):
+            await upstream.request(client, "GET", url, parse)
+        assert calls == [503, 503]
+        await asyncio.sleep(0.25)
+        assert await upstream.request(client, "GET", url, parse) == {"ok": True}
+        assert upstream.breaker.opened_at is None and upstream.breaker.failures == 0
+
+    run_with_server([503, 503], scenario)
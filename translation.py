@@ -0,0 +1,134 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from cache import TTLCache, normalize_query
+from metrics import observe_api
+from quantity import UNITS, parse_item, split_items
+from config import settings
+
+# Встроенный словарь частых продуктов, тренировок и городов, ключи в нормализованном виде
+RU_EN = {
+    # продукты
+    "яблоко": "apple", "банан": "banana", "апельсин": "orange", "груша": "pear", "виноград": "grapes",
+    "мандарин": "tangerine", "лимон": "lemon", "арбуз": "watermelon", "дыня": "melon", "персик": "peach",
+    "клубника": "strawberry", "малина": "raspberry", "вишня": "cherry", "киви": "kiwi", "ананас": "pineapple",
+    "картофель": "potato", "картошка": "potato", "морковь": "carrot", "капуста": "cabbage", "огурец": "cucumber",
+    "помидор": "tomato", "томат": "tomato", "лук": "onion", "чеснок": "garlic", "перец": "pepper",
+    "брокколи": "broccoli", "кабачок": "zucchini", "свекла": "beet", "тыква": "pumpkin", "авокадо": "avocado",
+    "рис": "rice", "гречка": "buckwheat", "овсянка": "oatmeal", "макароны": "pasta", "хлеб": "bread",
+    "батон": "white bread", "булка": "bun", "пшено": "millet", "кукуруза": "corn", "фасоль": "beans",
+    "горох": "peas", "чечевица": "lentils", "курица": "chicken", "куриная грудка": "chicken breast",
+    "говядина": "beef", "свинина": "pork", "индейка": "turkey", "баранина": "lamb", "рыба": "fish",
+    "лосось": "salmon", "тунец": "tuna", "креветки": "shrimp", "яйцо": "egg", "яйца": "eggs",
+    "колбаса": "sausage", "сосиска": "hot dog", "ветчина": "ham", "бекон": "bacon", "молоко": "milk",
+    "кефир": "kefir", "йогурт": "yogurt", "творог": "cottage cheese", "сыр": "cheese", "сметана": "sour cream",
+    "масло": "butter", "сливочное масло": "butter", "оливковое масло": "olive oil", "сахар": "sugar",
+    "мед": "honey", "мёд": "honey", "шоколад": "chocolate", "печенье": "cookie", "торт": "cake",
+    "мороженое": "ice cream", "орехи": "nuts", "арахис": "peanuts", "миндаль": "almonds", "кофе": "coffee",
+    "чай": "tea", "сок": "juice", "пицца": "pizza", "бургер": "burger", "суп": "soup", "борщ": "borscht",
+    "пельмени": "dumplings", "блины": "pancakes", "салат": "salad", "каша": "porridge", "омлет": "omelette",
+    # тренировки
+    "бег": "running", "ходьба": "walking", "плавание": "swimming", "велосипед": "cycling", "йога": "yoga",
+    "теннис": "tennis", "футбол": "soccer", "баскетбол": "basketball", "волейбол": "volleyball",
+    "бокс": "boxing", "танцы": "dancing", "лыжи": "skiing", "коньки": "skating", "гребля": "rowing",
+    "пилатес": "pilates", "аэробика": "aerobics", "скакалка": "jump rope", "растяжка": "stretching",
+    "кроссфит": "crossfit", "зал": "weight lifting", "штанга": "weight lifting", "приседания": "squats",
+    "отжимания": "push-ups", "подтягивания": "pull-ups", "пресс": "sit-ups", "степ": "step aerobics",
+    # города
+    "москва": "Moscow", "санкт-петербург": "Saint Petersburg", "петербург": "Saint Petersburg",
+    "питер": "Saint Petersburg", "новосибирск": "Novosibirsk", "екатеринбург": "Yekaterinburg",
+    "казань": "Kazan", "нижний новгород": "Nizhny Novgorod", "челябинск": "Chelyabinsk", "самара": "Samara",
+    "омск": "Omsk", "ростов-на-дону": "Rostov-on-Don", "уфа": "Ufa", "красноярск": "Krasnoyarsk",
+    "воронеж": "Voronezh", "пермь": "Perm", "волгоград": "Volgograd", "краснодар": "Krasnodar",
+    "саратов": "Saratov", "тюмень": "Tyumen", "сочи": "Sochi", "калининград": "Kaliningrad",
+    "владивосток": "Vladivostok", "иркутск": "Irkutsk", "хабаровск": "Khabarovsk", "ярославль": "Yaroslavl",
+    "минск": "Minsk", "киев": "Kyiv", "алматы": "Almaty", "астана": "Astana", "ташкент": "Tashkent",
+}
+
+_translator = None
+# Удаленный переводчик блокирующий, поэтому выполняется в отдельном пуле потоков
+executor = ThreadPoolExecutor(max_workers=settings.translate_workers, thread_name_prefix="translate")
+remote_limit = asyncio.Semaphore(settings.translate_workers)
+# Время жизни конечное, чтобы случайно закэшированный неудачный перевод со временем обновился
+translate_cache = TTLCache("translate", settings.translate_cache_size, settings.translate_cache_ttl)
+# Предупреждения MyMemory о квоте и ошибках запроса, которые приходят вместо перевода
+_PROVIDER_WARNING = re.compile(r"MYMEMORY WARNING|QUERY LENGTH LIMIT|INVALID LANGUAGE PAIR|"
+                               r"PLEASE SELECT TWO DISTINCT LANGUAGES|LIMIT EXCEEDED", re.IGNORECASE)
+
+
+def lookup_item(text: str) -> str | None:
+    """Перевод одной позиции по словарю с сохранением количества и единицы"""
+    if text in RU_EN:
+        return RU_EN[text]
+    amount, unit, name = parse_item(text)
+    if amount is not None:
+        name = lookup_item(name)
+        if name is None:
+            return None
+        return " ".join(filter(None, (f"{amount:g}", UNITS[unit][0] if unit else None, name)))
+    words = text.split()
+    if all(word in RU_EN or word.isdigit() for word in words):
+        return " ".join(RU_EN.get(word, word) for word in words)
+    return None
+
+
+def lookup(text: str) -> str | None:
+    """Перевод по встроенному словарю целиком, по позициям или по словам"""
+    key = normalize_query(text)
+    items = split_items(key)
+    translated = [lookup_item(item) for item in items]
+    if not items or None in translated:
+        return None
+    return " and ".join(translated)
+
+
+def _translate_sync(text: str) -> str:
+    """Перевод внешним переводчиком в потоке пула, библиотека загружается при первом переводе"""
+    global _translator  # pylint: disable=W0603
+    if _translator is None:
+        from translate import Translator  # pylint: disable=C0415
+        translator = Translator(to_lang="en", from_lang="ru")
+        if settings.translate_api_url:
+            translator.provider.base_url = settings.translate_api_url
+        _translator = translator
+    return _translator.translate(text)
+
+
+def _release_slot(job: asyncio.Future):
+    """Освобождение слота переводчика после фактического завершения потока"""
+    remote_limit.release()
+    if not job.cancelled():
+        # результат опоздавшего после таймаута перевода никто не ждет, ошибку помечаем полученной
+        job.exception()
+
+
+async def translate_remote(text: str) -> str:
+    """Перевод через внешний сервис вне event loop с ограничением параллельности и времени"""
+    await remote_limit.acquire()
+    try:
+        job = asyncio.get_running_loop().run_in_executor(executor, _translate_sync, text)
+    except BaseException:
+        remote_limit.release()
+        raise
+    # слот занят, пока поток работает, даже если ожидание ответа уже прервано таймаутом
+    job.add_done_callback(_release_slot)
+    async with observe_api("translate") as call:
+        result = await asyncio.wait_for(asyncio.shield(job), settings.translate_timeout)
+        # такой ответ не кэшируется: translate вернет исходный текст, следующий запрос спросит сервис снова
+        if not result or _PROVIDER_WARNING.search(result) or normalize_query(result) == normalize_query(text):
+            call.status = "rejected"
+            raise ValueError(f"Переводчик не перевел {text!r}: {result!r}")
+        call.status = "ok"
+        return result
+
+
+async def translate(text: str) -> str:
+    """Функция перевода с русского на английский язык"""
+    local = lookup(text)
+    if local is not None:
+        return local
+    try:
+        return await translate_cache.get_or_load(normalize_query(text), lambda: translate_remote(text))
+    except Exception:  # pylint: disable=W0718
+        # без перевода внешние API часто все равно понимают запрос
+        return text
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable
+import aiohttp
+from metrics import observe_api, api_retries, circuit_open
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    """Ошибка внешнего API"""
+
+    def __init__(self, service: str, message: str, status: int | None = None):
+        super().__init__(message)
+        self.service = service
+        self.status = status
+
+
+class UpstreamUnavailable(UpstreamError):
+    """API временно недоступен: 5xx, 429, сетевая ошибка или истек дедлайн"""
+
+    def __init__(self, service: str, message: str, status: int | None = None, retry_after: float | None = None):
+        super().__init__(service, message, status)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Автомат разомкнут, запрос не отправлялся"""
+
+
+class RateLimited(UpstreamUnavailable):
+    """Свой лимит частоты не дает отправить запрос до дедлайна, API при этом не виноват"""
+
+
+class ServiceDisabled(UpstreamUnavailable):
+    """API не настроен (нет токена), запрос не отправлялся"""
+
+
+class NotFound(UpstreamError, LookupError):
+    """API ответил, что по запросу ничего нет"""
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> float:
+        """Пополнение токенов за прошедшее время, возвращает текущий запас"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def try_acquire(self, cost: float = 1) -> float:
+        """Списание cost токенов без ожидания: 0 при успехе, иначе сколько секунд ждать"""
+        if self.rate <= 0:
+            return 0
+        # дороже запаса ведра не списать никогда, поэтому стоимость ограничена емкостью
+        cost = min(cost, self.capacity)
+        tokens = self.refill(time.monotonic())
+        if tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - tokens) / self.rate
+
+    def reserve(self, max_wait: float) -> float | None:
+        """Бронирование токена в очереди: сколько секунд ждать, None - если дольше max_wait"""
+        if self.rate <= 0:
+            return 0
+        tokens = self.refill(time.monotonic())
+        wait = max(0.0, (1 - tokens) / self.rate)
+        if wait >= max_wait:
+            return None
+        # запас может уйти в минус: следующие ждут, пока его вернет пополнение
+        self.tokens -= 1
+        return wait
+
+    async def acquire(self):
+        """Ожидание свободного токена"""
+        while wait := self.try_acquire():
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """Автомат защиты: после failures неудачных вызовов подряд запросы отклоняются сразу.
+
+    Раз в reset_timeout секунд пропускается один пробный запрос, его успех замыкает автомат.
+    """
+
+    def __init__(self, service: str, failures: int, reset_timeout: float):
+        self.service = service
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос"""
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # пробный запрос, следующий - не раньше чем через reset_timeout, даже если этот завис
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self):
+        """Успешный вызов замыкает автомат"""
+        if self.opened_at is not None:
+            logger.info("API %s снова доступен", self.service)
+            circuit_open.set(self.service, value=0)
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        """Неудачный вызов, при достижении порога или неудачной пробе автомат размыкается"""
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("API %s недоступен, запросы отклоняются %s с", self.service, self.reset_timeout)
+                circuit_open.set(self.service, value=1)
+            self.opened_at = time.monotonic()
+
+
+def _retry_after(response: aiohttp.ClientResponse) -> float | None:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class Upstream:
+    """Обертка запросов к одному внешнему API с дедлайном, повторами, лимитом частоты и автоматом.
+
+    Повторяются ответы 5xx и 429 и сетевые ошибки, пауза между попытками случайная. Лимит частоты
+    действует в пределах процесса, при запуске через cluster.py его делит на воркеры share_quota.
+    Ожидание своего лимита не входит в дедлайн и не считается ошибкой API: если токена не дождаться
+    за deadline секунд, запрос отклоняется RateLimited без учета в автомате.
+    Выключенный API (enabled=False) сразу отвечает ServiceDisabled, как недоступный.
+    """
+
+    def __init__(self, service: str, rate: float, burst: float, deadline: float, retries: int, backoff: float,
+                 failures: int, reset_timeout: float, enabled: bool = True):
+        self.service = service
+        self.enabled = enabled
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(service, failures, reset_timeout)
+
+    def share_quota(self, workers: int):
+        """Деление лимита частоты на workers процессов, чтобы вместе они укладывались в квоту провайдера"""
+        bucket = self.bucket
+        self.bucket = TokenBucket(bucket.rate / workers, max(1.0, bucket.capacity / workers))
+
+    async def request(self, client: aiohttp.ClientSession, method: str, url: str,
+                      parse: Callable[[aiohttp.ClientResponse], Awaitable[Any]], **kwargs) -> Any:
+        """Запрос с разбором успешного ответа через parse, ошибки - подклассы UpstreamError"""
+        if not self.enabled:
+            raise ServiceDisabled(self.service, f"API {self.service} не настроен")
+        if not self.breaker.allow():
+            raise CircuitOpen(self.service, f"API {self.service} временно недоступен")
+        # ожидание своего лимита не входит в дедлайн, иначе таймаут из-за очереди засчитывался бы API
+        wait = self.bucket.reserve(self.deadline)
+        if wait is None:
+            raise RateLimited(self.service, f"Превышен лимит запросов к API {self.service}")
+        await asyncio.sleep(wait)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        try:
+            async with asyncio.timeout_at(deadline):
+                result = await self._request_with_retries(client, method, url, parse, deadline, kwargs)
+        except TimeoutError:
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(self.service, f"API {self.service} не ответил за {self.deadline} с") from None
+        except UpstreamUnavailable:
+            self.breaker.record_failure()
+            raise
+        except UpstreamError:
+            # API ответил, значит он доступен, даже если запрос не удался
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def _request_with_retries(self, client: aiohttp.ClientSession, method: str, url: str,
+                                    parse: Callable[[aiohttp.ClientResponse], Awaitable[Any]], deadline: float,
+                                    kwargs: dict) -> Any:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(client, method, url, parse, kwargs)
+            except UpstreamUnavailable as e:
+                # полный джиттер, чтобы повторы разных запросов не совпадали по времени
+                delay = e.retry_after if e.retry_after is not None else random.uniform(0, self.backoff * 2 ** attempt)
+                if attempt >= self.retries or loop.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                api_retries.inc(self.service)
+                await asyncio.sleep(delay)
+                # повтору тоже нужен токен; если его не дождаться до дедлайна, наружу уходит ошибка API
+                wait = self.bucket.reserve(deadline - loop.time())
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+
+    async def _attempt(self, client: aiohttp.ClientSession, method: str, url: str,
+                       parse: Callable[[aiohttp.ClientResponse], Awaitable[Any]], kwargs: dict) -> Any:
+        async with observe_api(self.service) as call:
+            try:
+                async with client.request(method, url, **kwargs) as response:
+                    call.status = response.status
+                    if response.status == 200:
+                        return await parse(response)
+                    if response.status == 404:
+                        raise NotFound(self.service, "Ничего не найдено", response.status)
+                    if response.status == 429 or response.status >= 500:
+                        raise UpstreamUnavailable(self.service, f"API {self.service} ответил {response.status}",
+                                                  response.status, _retry_after(response))
+                    raise UpstreamError(self.service, f"API {self.service} ответил {response.status}",
+                                        response.status)
+            except (aiohttp.ClientError, TimeoutError) as e:
+                # разрыв соединения или таймаут чтения сессии, повторяется как 5xx
+                call.status = "timeout" if isinstance(e, TimeoutError) else "error"
+                raise UpstreamUnavailable(self.service, f"API {self.service}: {e!r}") from e
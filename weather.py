@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from aiohttp import ClientResponse, ClientSession
+from cache import TTLCache, normalize_query
+from config import settings
+from storage import UserStore
+from translation import translate
+from upstream import Upstream
+
+logger = logging.getLogger(__name__)
+
+# Температура по городу: свежая WEATHER_CACHE_TTL секунд, затем еще WEATHER_STALE_TTL отдается сразу
+weather_cache = TTLCache("weather", 10000, settings.weather_cache_ttl, stale_ttl=settings.weather_stale_ttl)
+weather_api = Upstream("weather", settings.weather_rate, settings.weather_burst, settings.api_deadline,
+                       settings.api_retries, settings.api_backoff, settings.api_breaker_failures,
+                       settings.api_breaker_reset, enabled=settings.weather_enabled)
+
+
+async def parse_temp(response: ClientResponse) -> float:
+    """Температура из ответа openweathermap"""
+    data = await response.json()
+    return float(data['main']['temp'])
+
+
+async def fetch_temp(client: ClientSession, selected_city: str) -> float:
+    """Запрос температуры в openweathermap"""
+    url = f"{settings.weather_api_url}/data/2.5/weather"
+    params = {"q": selected_city, "appid": settings.weather_token, "units": "metric"}
+    return await weather_api.request(client, "GET", url, parse_temp, params=params)
+
+
+async def get_temp(client: ClientSession, selected_city: str) -> float:
+    """Функция получения температуры, ошибки API - подклассы UpstreamError"""
+    return await weather_cache.get_or_load(normalize_query(selected_city),
+                                           lambda: fetch_temp(client, selected_city))
+
+
+async def prefetch_weather(client: ClientSession, store: UserStore, active_days: float = settings.weather_active_days):
+    """Прогрев кэша погоды для городов пользователей, обращавшихся к боту за последние active_days дней"""
+    # дата дня в профиле не годится: ночная смена дня обновляет ее всем пользователям
+    cities = set()
+    for user_id in await store.active_user_ids(time.time() - active_days * 24 * 3600):
+        try:
+            user = await store.get(user_id)
+        except KeyError:
+            # обращался к боту, но профиль не заполнил
+            continue
+        if user.get("city"):
+            cities.add(user["city"])
+
+    limit = asyncio.Semaphore(settings.weather_prefetch_concurrency)
+
+    async def warm(city: str):
+        async with limit:
+            city = await translate(city)
+            await weather_cache.refresh(normalize_query(city), lambda: fetch_temp(client, city))
+
+    results = await asyncio.gather(*(warm(city) for city in cities), return_exceptions=True)
+    failed = sum(isinstance(result, Exception) for result in results)
+    logger.info("Прогрев погоды: %s городов, ошибок %s", len(cities), failed)
+
+
+async def run_prefetch_scheduler(client: ClientSession, store: UserStore):
+    """Ежедневный прогрев кэша погоды в WEATHER_PREFETCH_AT (ЧЧ:ММ по времени сервера)"""
+    while True:
+        now = datetime.now()
+        start = datetime.combine(now.date(), settings.weather_prefetch_at)
+        if start <= now:
+            start += timedelta(days=1)
+        await asyncio.sleep((start - now).total_seconds())
+        try:
+            await prefetch_weather(client, store)
+        except Exception:  # pylint: disable=W0718
+            logger.exception("Не удалось прогреть кэш погоды")
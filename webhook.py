@@ -0,0 +1,132 @@
+import asyncio
+import hmac
+import logging
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update: Update) -> int:
+    """Идентификатор пользователя из обновления, для обновлений без пользователя - id обновления"""
+    try:
+        user = getattr(update.event, "from_user", None)
+    except Exception:  # pylint: disable=W0718
+        user = None
+    return user.id if user is not None else update.update_id
+
+
+class UpdateQueue:
+    """Ограниченная очередь обновлений с фиксированным числом обработчиков.
+
+    Обновления одного пользователя попадают в одну очередь, которую разбирают shard_workers обработчиков;
+    блокировка пользователя сохраняет порядок его обновлений, а медленный обработчик не задерживает
+    остальных пользователей очереди. При заполненной очереди вебхук отвечает 503 и Telegram повторяет
+    доставку позже.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int, maxsize: int,
+                 shard_workers: int = settings.webhook_shard_workers):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.shard_workers = min(shard_workers, workers)
+        shards = max(1, workers // self.shard_workers)
+        self.queues = [asyncio.Queue(maxsize=max(1, maxsize // shards)) for _ in range(shards)]
+        # блокировка и число взятых в работу обновлений пользователя, запись удаляется при нуле
+        self._users: dict[int, list] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(queue))
+                       for queue in self.queues for _ in range(self.shard_workers)]
+
+    async def put(self, update: Update, timeout: float) -> bool:
+        """Постановка обновления в очередь, False если место не освободилось за timeout"""
+        queue = self.queues[update_user_id(update) % len(self.queues)]
+        try:
+            await asyncio.wait_for(queue.put(update), timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    async def drain(self, timeout: float):
+        """Дожидаемся обработки уже принятых обновлений и останавливаем обработчики"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except TimeoutError:
+            logger.warning("Не дождались обработки %s обновлений", self.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            # блокировка берется сразу после извлечения, без переключения задач, поэтому
+            # обновления пользователя обрабатываются в порядке очереди
+            user_id = update_user_id(update)
+            user = self._users.setdefault(user_id, [asyncio.Lock(), 0])
+            user[1] += 1
+            try:
+                async with user[0]:
+                    await self.dispatcher.feed_update(self.bot, update)
+            except Exception:  # pylint: disable=W0718
+                logger.exception("Ошибка обработки обновления %s", update.update_id)
+            finally:
+                user[1] -= 1
+                if not user[1]:
+                    del self._users[user_id]
+                queue.task_done()
+
+
+def create_webhook_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    """Веб-приложение aiohttp, принимающее обновления Telegram"""
+    app = web.Application()
+    updates = UpdateQueue(dispatcher, bot, settings.webhook_workers, settings.webhook_queue_size)
+
+    async def handle(request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        # байты, а не str: compare_digest падает с TypeError на не-ASCII заголовке
+        if not hmac.compare_digest(token.encode(), settings.webhook_secret.encode()):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except ValueError as e:
+            # битый JSON или не обновление Telegram: повтор доставки не поможет
+            logger.warning("Некорректное тело запроса вебхука: %s", e)
+            return web.Response(status=400)
+        if not await updates.put(update, settings.webhook_enqueue_timeout):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(_app: web.Application):
+        updates.start()
+        await bot.set_webhook(f"{settings.webhook_url}{settings.webhook_path}", secret_token=settings.webhook_secret)
+
+    async def on_shutdown(_app: web.Application):
+        await updates.drain(timeout=30)
+
+    app.router.add_post(settings.webhook_path, handle)
+    app.on_startup.append(on_startup)
+    # очередь разбираем до остановки диспетчера, который закрывает сессию и хранилища
+    app.on_shutdown.append(on_shutdown)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    """Запуск веб-сервера вебхука до остановки процесса"""
+    runner = web.AppRunner(create_webhook_app(dispatcher, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()